@@ -4,7 +4,13 @@ import os
 from argparse import ArgumentParser, RawDescriptionHelpFormatter, ArgumentDefaultsHelpFormatter
 
 import boto3
-import numpy as np
+from botocore.exceptions import ClientError
+
+from ledger import Ledger
+from records import iter_hits
+from response_cache import CachedClient
+from rate_limiter import RateLimitedClient, CLIENT_CONFIG
+from profiling import add_profiling_arguments, start_profiling
 
 DESCRIPTION = \
     """
@@ -48,45 +54,51 @@ def mturk_client():
     client = boto3.client(
         'mturk',
         aws_access_key_id=key_id,
-        aws_secret_access_key=key
+        aws_secret_access_key=key,
+        config=CLIENT_CONFIG
     )
-    return client
+    return CachedClient(RateLimitedClient(client, account=key_id))
+
 
+def credit_hit(client, hit_id, ledger):
+    # pick up approvals made by other approvers since the ledger was read
+    ledger.refresh()
 
-def credit_hit(hit_id, credited_workers=set(), credited_assignments=set()):
     assignments = client.list_assignments_for_hit(
         HITId=hit_id,
         MaxResults=100,
         AssignmentStatuses=['Submitted']
     )
 
+    n_credited = 0
     for ass in assignments['Assignments']:
         ass_id = ass['AssignmentId']
         worker_id = ass['WorkerId']
+        if ('approve', ass_id) in ledger:
+            continue
+
         print('\tCrediting worker {} on assignment {}'
               .format(worker_id, ass_id))
 
-        _ = client.approve_assignment(
-            AssignmentId=ass_id,
-            RequesterFeedback='Thank you for completing our experiment!',
-            OverrideRejection=False
-        )
-
-        credited_workers.add(worker_id)
-        credited_assignments.add(ass_id)
-    return credited_workers, credited_assignments
-
+        try:
+            _ = client.approve_assignment(
+                AssignmentId=ass_id,
+                RequesterFeedback='Thank you for completing our experiment!',
+                OverrideRejection=False
+            )
+        except ClientError:
+            # MTurk refuses to approve an assignment that is no longer
+            # Submitted, e.g. when another approver got there first
+            ass = client.get_assignment(AssignmentId=ass_id)['Assignment']
+            if ass['AssignmentStatus'] != 'Approved':
+                raise
+            print('\tAssignment {} was already approved'.format(ass_id))
+            ledger.add('approve', ass_id, worker_id=worker_id, hit_id=hit_id)
+            continue
 
-def load_roster():
-    credited_hits = set()
-    credited_workers = set()
-    credited_assignments = set()
-    if os.path.lexists('credited.npz'):
-        credited = np.load('credited.npz')
-        credited_hits = set(credited['credited_hits'])
-        credited_workers = set(credited['credited_workers'])
-        credited_assignments = set(credited['credited_assignments'])
-    return credited_hits, credited_workers, credited_assignments
+        ledger.add('approve', ass_id, worker_id=worker_id, hit_id=hit_id)
+        n_credited += 1
+    return n_credited
 
 
 if __name__ == "__main__":
@@ -101,7 +113,9 @@ if __name__ == "__main__":
         type=str,
         help="title of the experiment/HIT.")
 
+    add_profiling_arguments(parser)
     args = parser.parse_args()
+    start_profiling(args)
     HIT_TITLE = args.title
 
     # if HIT title is not specified at the command line, try to load it from
@@ -117,31 +131,27 @@ if __name__ == "__main__":
                     HIT_TITLE = line.split('=')[-1].strip()
 
     # try loading the info on already-credited HIT from previous runs
-    credited_hits, credited_workers, credited_assignments = load_roster()
+    ledger = Ledger()
 
     client = mturk_client()
 
     print('Retrieving reviewable HITs...')
-    pages = all_pages(
+    hits = list(iter_hits(
         client.list_reviewable_hits,
+        fields=['HITId'],
         Status='Reviewable',
         MaxResults=100
-    )
-
-    hits = []
-    for page in pages:
-        hits += page['HITs']
+    ))
 
     for hit in hits:
         hit = client.get_hit(HITId=hit['HITId'])['HIT']
-        already_done = hit['HITId'] in credited_hits
+        already_done = ('hit', hit['HITId']) in ledger
 
         if hit['Title'] == HIT_TITLE and not already_done:
             print('Collecting workers for HIT {}, title: `{}`'
                   .format(hit['HITId'], hit['Title']))
 
-            credited_workers, credited_assignments = credit_hit(
-                hit['HITId'], credited_workers, credited_assignments)
+            credit_hit(client, hit['HITId'], ledger)
 
             #  assignments = client.list_assignments_for_hit(
             #      HITId=hit['HITId'],
@@ -163,11 +173,4 @@ if __name__ == "__main__":
             #      credited_workers.add(worker_id)
             #      credited_assignments.add(ass_id)
 
-            credited_hits.add(hit['HITId'])
-
-            np.savez(
-                'credited.npz',
-                credited_hits=np.array(list(credited_hits)),
-                credited_workers=np.array(list(credited_workers)),
-                credited_assignments=np.array(list(credited_assignments)),
-            )
+            ledger.add('hit', hit['HITId'])
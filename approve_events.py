@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter
+
+import boto3
+
+from ledger import Ledger
+from records import iter_hits
+from response_cache import CachedClient
+from approve_hit import credit_hit
+from rate_limiter import RateLimitedClient, CLIENT_CONFIG
+from profiling import add_profiling_arguments, start_profiling
+
+DESCRIPTION = """
+Event-driven HIT approver. Instead of polling `list_reviewable_hits`, MTurk is
+asked to send AssignmentSubmitted and HITReviewable notifications for the
+experiment's HIT types to an SQS queue. The queue is long-polled and each
+batch of events is handled by approving just the assignments (or HITs) that
+it names. Approvals are recorded in the same ledger as `approve_batch.py`.
+
+Pass `--setup` once to point the HIT types' notifications at the queue. Use
+`--endpoint_url` to consume from a local SQS-compatible service (e.g.
+ElasticMQ) when testing.
+
+Usage
+-----
+    >>> export AWS_ACCESS_KEY_ID=<MTurk access key id>
+    >>> export AWS_SECRET_ACCESS_KEY=<MTurk secret access key>
+    >>> approve_events.py -t <HIT title> -q <SQS queue URL> --setup
+"""
+
+EVENT_TYPES = ['AssignmentSubmitted', 'HITReviewable']
+
+
+class CustomFormatter(ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter):
+    pass
+
+
+def mturk_client():
+    print("Connecting to mechanical turk...")
+    key_id = os.environ['AWS_ACCESS_KEY_ID']
+    key = os.environ['AWS_SECRET_ACCESS_KEY']
+
+    client = boto3.client(
+        'mturk',
+        aws_access_key_id=key_id,
+        aws_secret_access_key=key,
+        config=CLIENT_CONFIG
+    )
+    return CachedClient(RateLimitedClient(client, account=key_id))
+
+
+def sqs_client(region, endpoint_url=None):
+    key_id = os.environ['AWS_ACCESS_KEY_ID']
+    key = os.environ['AWS_SECRET_ACCESS_KEY']
+
+    client = boto3.client(
+        'sqs',
+        region_name=region,
+        endpoint_url=endpoint_url,
+        aws_access_key_id=key_id,
+        aws_secret_access_key=key
+    )
+    return client
+
+
+def hit_types_for_title(client, title):
+    hits = iter_hits(client.list_hits, fields=['HITTypeId', 'Title'], MaxResults=100)
+    return set(h.HITTypeId for h in hits if h.Title == title)
+
+
+def setup_notifications(client, sqs, queue_url, hit_types):
+    queue_arn = sqs.get_queue_attributes(
+        QueueUrl=queue_url,
+        AttributeNames=['QueueArn']
+    )['Attributes']['QueueArn']
+
+    for hit_type in hit_types:
+        print('Sending {} notifications for HIT type {} to {}'
+              .format(', '.join(EVENT_TYPES), hit_type, queue_arn))
+
+        client.update_notification_settings(
+            HITTypeId=hit_type,
+            Notification={
+                'Destination': queue_arn,
+                'Transport': 'SQS',
+                'Version': '2014-08-15',
+                'EventTypes': EVENT_TYPES,
+            },
+            Active=True
+        )
+
+
+def parse_events(message):
+    body = json.loads(message['Body'])
+    return body.get('Events', [])
+
+
+def approve_assignment(client, ass_id, ledger):
+    if ('approve', ass_id) in ledger:
+        return 0
+
+    ass = client.get_assignment(AssignmentId=ass_id)['Assignment']
+    if ass['AssignmentStatus'] != 'Submitted':
+        return 0
+
+    print('\tCrediting worker {} on assignment {}'
+          .format(ass['WorkerId'], ass_id))
+
+    _ = client.approve_assignment(
+        AssignmentId=ass_id,
+        RequesterFeedback='Thank you for completing our experiment!',
+        OverrideRejection=False
+    )
+
+    ledger.add('approve', ass_id, worker_id=ass['WorkerId'], hit_id=ass['HITId'])
+    return 1
+
+
+def event_ids(event):
+    return [event[k] for k in ['AssignmentId', 'HITId'] if event.get(k)]
+
+
+def handle_events(client, events, hit_types, ledger):
+    """Approve the assignments named in a batch of events. Returns the number
+    of assignments approved and the IDs of the assignments / HITs that could
+    not be handled"""
+    assignments, hits = [], []
+    for event in events:
+        if hit_types and event.get('HITTypeId') not in hit_types:
+            continue
+
+        if event['EventType'] == 'AssignmentSubmitted':
+            if event['AssignmentId'] not in assignments:
+                assignments.append(event['AssignmentId'])
+        elif event['EventType'] == 'HITReviewable':
+            if event['HITId'] not in hits:
+                hits.append(event['HITId'])
+
+    n_approved, failed = 0, set()
+    for ass_id in assignments:
+        try:
+            n_approved += approve_assignment(client, ass_id, ledger)
+        except Exception as e:
+            print('\tCould not approve assignment {}: {}'.format(ass_id, e))
+            failed.add(ass_id)
+
+    # a reviewable HIT may still hold submissions whose events we missed
+    for hit_id in hits:
+        if ('hit', hit_id) in ledger:
+            continue
+        print('Collecting workers for reviewable HIT {}'.format(hit_id))
+        try:
+            n_approved += credit_hit(client, hit_id, ledger)
+        except Exception as e:
+            print('\tCould not credit HIT {}: {}'.format(hit_id, e))
+            failed.add(hit_id)
+            continue
+        ledger.add('hit', hit_id)
+    return n_approved, failed
+
+
+def consume(client, sqs, queue_url, hit_types, ledger,
+            batch_size=10, wait_time=20, once=False):
+    while True:
+        response = sqs.receive_message(
+            QueueUrl=queue_url,
+            MaxNumberOfMessages=batch_size,
+            WaitTimeSeconds=wait_time
+        )
+        messages = response.get('Messages', [])
+
+        if not messages:
+            if once:
+                return
+            continue
+
+        # pick up approvals made by other scripts since the last batch
+        ledger.refresh()
+
+        events, message_events = [], []
+        for message in messages:
+            try:
+                message_events.append(parse_events(message))
+            except ValueError:
+                print('Skipping malformed message {}'.format(message['MessageId']))
+                message_events.append([])
+            events += message_events[-1]
+
+        n_approved, failed = handle_events(client, events, hit_types, ledger)
+
+        # messages naming an assignment or HIT that failed aren't deleted, so
+        # they are redelivered once their visibility timeout expires
+        handled = [
+            {'Id': message['MessageId'], 'ReceiptHandle': message['ReceiptHandle']}
+            for message, msg_events in zip(messages, message_events)
+            if not any(i in failed for e in msg_events for i in event_ids(e))
+        ]
+        if handled:
+            sqs.delete_message_batch(QueueUrl=queue_url, Entries=handled)
+        print('{}: {} events, {} assignments approved, {} messages kept for retry'
+              .format(time.strftime('%H:%M:%S'), len(events), n_approved,
+                      len(messages) - len(handled)))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description=DESCRIPTION,
+        formatter_class=CustomFormatter)
+
+    parser.add_argument(
+        '-q',
+        "--queue_url",
+        metavar="URL",
+        required=True,
+        type=str,
+        help="URL of the SQS queue receiving the notifications")
+
+    parser.add_argument(
+        '-t',
+        "--title",
+        metavar="TITLE",
+        type=str,
+        help="title of the experiment/HIT")
+
+    parser.add_argument(
+        "--hit_type",
+        metavar="ID",
+        action="append",
+        default=[],
+        help="HIT type ID to handle events for (can be repeated)")
+
+    parser.add_argument(
+        "--setup",
+        action="store_true",
+        help="point the HIT types' notifications at the queue before consuming")
+
+    parser.add_argument(
+        "--region",
+        default="us-east-1",
+        type=str,
+        help="AWS region of the SQS queue")
+
+    parser.add_argument(
+        "--endpoint_url",
+        metavar="URL",
+        type=str,
+        help="SQS endpoint, e.g. a local SQS-compatible service for testing")
+
+    parser.add_argument(
+        "--batch_size",
+        default=10,
+        type=int,
+        help="maximum number of messages to receive at once (1-10)")
+
+    parser.add_argument(
+        "--wait_time",
+        default=20,
+        type=int,
+        help="long-polling wait time (in seconds, 0-20)")
+
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="exit once the queue is empty instead of waiting for new events")
+
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    start_profiling(args)
+
+    client = mturk_client()
+    sqs = sqs_client(args.region, args.endpoint_url)
+
+    hit_types = set(args.hit_type)
+    if args.title:
+        title_types = hit_types_for_title(client, args.title)
+        if not title_types:
+            raise ValueError('Cannot find any HITs with title `{}`'
+                             .format(args.title))
+        hit_types |= title_types
+
+    if args.setup:
+        if not hit_types:
+            raise ValueError('--setup requires --title or --hit_type')
+        setup_notifications(client, sqs, args.queue_url, hit_types)
+
+    ledger = Ledger()
+
+    print('Waiting for events...')
+    try:
+        consume(client, sqs, args.queue_url, hit_types, ledger,
+                args.batch_size, args.wait_time, args.once)
+    except KeyboardInterrupt:
+        print('Exiting...')
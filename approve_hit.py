@@ -5,7 +5,12 @@ import sys
 from argparse import ArgumentParser, RawDescriptionHelpFormatter, ArgumentDefaultsHelpFormatter
 
 import boto3
-import numpy as np
+from botocore.exceptions import ClientError
+
+from ledger import Ledger
+from response_cache import CachedClient
+from rate_limiter import RateLimitedClient, CLIENT_CONFIG
+from profiling import add_profiling_arguments, start_profiling
 
 DESCRIPTION = """
 Approve workers for an individual HIT.
@@ -43,45 +48,51 @@ def mturk_client():
     client = boto3.client(
         'mturk',
         aws_access_key_id=key_id,
-        aws_secret_access_key=key
+        aws_secret_access_key=key,
+        config=CLIENT_CONFIG
     )
-    return client
+    return CachedClient(RateLimitedClient(client, account=key_id))
+
 
+def credit_hit(client, hit_id, ledger):
+    # pick up approvals made by other approvers since the ledger was read
+    ledger.refresh()
 
-def credit_hit(client, hit_id, credited_workers=set(), credited_assignments=set()):
     assignments = client.list_assignments_for_hit(
         HITId=hit_id,
         MaxResults=100,
         AssignmentStatuses=['Submitted']
     )
 
+    n_credited = 0
     for ass in assignments['Assignments']:
         ass_id = ass['AssignmentId']
         worker_id = ass['WorkerId']
+        if ('approve', ass_id) in ledger:
+            continue
+
         print('\tCrediting worker {} on assignment {}'
               .format(worker_id, ass_id))
 
-        _ = client.approve_assignment(
-            AssignmentId=ass_id,
-            RequesterFeedback='Thank you for completing our experiment!',
-            OverrideRejection=False
-        )
-
-        credited_workers.add(worker_id)
-        credited_assignments.add(ass_id)
-    return credited_workers, credited_assignments
-
-
-def load_roster():
-    credited_hits = set()
-    credited_workers = set()
-    credited_assignments = set()
-    if os.path.lexists('credited.npz'):
-        credited = np.load('credited.npz')
-        credited_hits = set(credited['credited_hits'])
-        credited_workers = set(credited['credited_workers'])
-        credited_assignments = set(credited['credited_assignments'])
-    return credited_hits, credited_workers, credited_assignments
+        try:
+            _ = client.approve_assignment(
+                AssignmentId=ass_id,
+                RequesterFeedback='Thank you for completing our experiment!',
+                OverrideRejection=False
+            )
+        except ClientError:
+            # MTurk refuses to approve an assignment that is no longer
+            # Submitted, e.g. when another approver got there first
+            ass = client.get_assignment(AssignmentId=ass_id)['Assignment']
+            if ass['AssignmentStatus'] != 'Approved':
+                raise
+            print('\tAssignment {} was already approved'.format(ass_id))
+            ledger.add('approve', ass_id, worker_id=worker_id, hit_id=hit_id)
+            continue
+
+        ledger.add('approve', ass_id, worker_id=worker_id, hit_id=hit_id)
+        n_credited += 1
+    return n_credited
 
 
 if __name__ == "__main__":
@@ -95,10 +106,12 @@ if __name__ == "__main__":
         type=str,
         help="The HIT ID")
 
+    add_profiling_arguments(parser)
     args = parser.parse_args()
+    start_profiling(args)
 
     # try loading the info on already-credited HIT from previous runs
-    credited_hits, credited_workers, credited_assignments = load_roster()
+    ledger = Ledger()
 
     client = mturk_client()
 
@@ -108,20 +121,11 @@ if __name__ == "__main__":
         print('Could not find HIT ID `{}`'.format(args.hit_id))
         sys.exit()
 
-    already_done = hit['HITId'] in credited_hits
+    already_done = ('hit', hit['HITId']) in ledger
 
     if not already_done:
         print('Collecting workers for HIT {}, title: `{}`'
               .format(hit['HITId'], hit['Title']))
 
-        credited_workers, credited_assignments = credit_hit(
-            client, hit['HITId'], credited_workers, credited_assignments)
-
-        credited_hits.add(hit['HITId'])
-
-        np.savez(
-            'credited.npz',
-            credited_hits=np.array(list(credited_hits)),
-            credited_workers=np.array(list(credited_workers)),
-            credited_assignments=np.array(list(credited_assignments)),
-        )
+        credit_hit(client, hit['HITId'], ledger)
+        ledger.add('hit', hit['HITId'])
@@ -5,6 +5,9 @@ from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, RawDescripti
 
 import boto3
 
+from rate_limiter import RateLimitedClient, CLIENT_CONFIG
+from profiling import add_profiling_arguments, start_profiling
+
 DESCRIPTION = \
     """
 Assign a qualification to a given worker ID/IDs. Useful for setting up
@@ -43,9 +46,10 @@ def mturk_client():
     client = boto3.client(
         'mturk',
         aws_access_key_id=key_id,
-        aws_secret_access_key=key
+        aws_secret_access_key=key,
+        config=CLIENT_CONFIG
     )
-    return client
+    return RateLimitedClient(client, account=key_id)
 
 
 if __name__ == "__main__":
@@ -70,7 +74,9 @@ if __name__ == "__main__":
         nargs="*",
         help="worker ID")
 
+    add_profiling_arguments(parser)
     args = parser.parse_args()
+    start_profiling(args)
 
     client = mturk_client()
 
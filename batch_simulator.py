@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo simulation of `psiturk_batcher.py` posting schedules.
+
+Every HIT the batcher posts shares one HIT type, so workers find the study's
+HIT group rather than individual HITs. Workers are modelled as arriving at the
+group as a Poisson process whose rate is highest right after a round of HITs
+is posted (which moves the group back to the top of the HIT listing) and
+decays as the round ages:
+
+    rate(t) = arrival_rate * exp(-(t - last_post) / decay)
+
+Each arriving worker takes one of the group's open slots, whichever HIT it
+belongs to; workers arriving while every slot posted so far is taken find
+nothing to accept. Given a schedule (the posting time and number of
+assignments of each HIT), `simulate` draws the arrivals in each round and,
+once the last round is posted, the time the last slot was taken, for
+thousands of runs at once. `fit_arrival_model` estimates `arrival_rate` and
+`decay` by maximum likelihood from the AcceptTimes of past HIT groups.
+
+All times are in seconds.
+"""
+import numpy as np
+
+from records import iter_hits, iter_assignments
+
+# MTurk commission: 20% of the reward, 40% for HITs with 10 or more
+# assignments, and at least $0.01 per assignment
+FEE = 0.2
+LARGE_HIT_FEE = 0.4
+LARGE_HIT_SIZE = 10
+MIN_FEE = 0.01
+
+DECAY_GRID = np.logspace(np.log10(10.), np.log10(7 * 24 * 3600.), 200)
+
+
+def posting_rounds(n_assignments, sleep_time, max_assignments, total_time=60):
+    """Return the sizes of the HITs `psiturk_batcher.py` posts in each round"""
+    n_rounds = int(total_time / sleep_time)
+    if n_rounds == 0:
+        raise ValueError('Sleep time {}s leaves no rounds within {}s'
+                         .format(sleep_time, total_time))
+
+    assignments_per_round = int(n_assignments / n_rounds)
+    remainder = n_assignments - n_rounds * assignments_per_round
+
+    rounds = []
+    for rr in range(1, n_rounds + 1):
+        n_this_round = assignments_per_round + (1 if rr <= remainder else 0)
+        n_full, n_mod = divmod(n_this_round, max_assignments)
+        rounds.append([max_assignments] * n_full + ([n_mod] if n_mod else []))
+    return rounds
+
+
+def posting_schedule(n_assignments, sleep_time, max_assignments, total_time=60):
+    """Return the posting times and sizes of the HITs `psiturk_batcher.py`
+    creates for the given arguments"""
+    times, sizes = [], []
+    rounds = posting_rounds(n_assignments, sleep_time, max_assignments, total_time)
+    for rr, round_sizes in enumerate(rounds):
+        # the round's HITs are posted back to back, then the batcher sleeps
+        times += [rr * sleep_time] * len(round_sizes)
+        sizes += round_sizes
+    return np.array(times, dtype=float), np.array(sizes, dtype=int)
+
+
+def _cumulative_rate(t, arrival_rate, decay):
+    return arrival_rate * decay * -np.expm1(-t / decay)
+
+
+def _inverse_cumulative_rate(x, arrival_rate, decay):
+    return -decay * np.log1p(-x / (arrival_rate * decay))
+
+
+def _rounds(times, sizes, end):
+    """Return the start and end of each posting round and the number of slots
+    open in the group during it"""
+    posts, round_ix = np.unique(times, return_inverse=True)
+    capacity = np.cumsum(np.bincount(round_ix, weights=sizes)).astype(int)
+    ends = np.append(posts[1:], max(end, posts[-1]))
+    return posts, ends, capacity
+
+
+def simulate(times, sizes, arrival_rate, decay, horizon, n_sims=5000, rng=None):
+    """Simulate `n_sims` runs of a schedule. Returns the completion time of
+    each run (NaN if some slot was still unfilled at the horizon) and the
+    number of unfilled slots in each run"""
+    rng = rng or np.random.default_rng()
+    posts, ends, capacity = _rounds(times, sizes, horizon)
+
+    # slots taken before the last round is posted; workers beyond the slots
+    # open in a round go away empty-handed
+    filled = np.zeros(n_sims, dtype=int)
+    for start, end, n_open in zip(posts[:-1], ends[:-1], capacity[:-1]):
+        expected = _cumulative_rate(end - start, arrival_rate, decay)
+        filled = np.minimum(filled + rng.poisson(expected, n_sims), n_open)
+
+    # every round adds slots, so at least one is left for the last round
+    remaining = capacity[-1] - filled
+    expected = _cumulative_rate(ends[-1] - posts[-1], arrival_rate, decay)
+    n_arrivals = rng.poisson(expected, n_sims)
+    done = n_arrivals >= remaining
+
+    # given n arrivals in the last round, the k-th one happens at the k-th
+    # order statistic of n draws from the (normalised) arrival rate, i.e. at
+    # Lambda^-1(U * Lambda(window)) with U ~ Beta(k, n - k + 1)
+    u = rng.beta(remaining, np.where(done, n_arrivals - remaining + 1, 1))
+    completion = np.where(
+        done, posts[-1] + _inverse_cumulative_rate(u * expected, arrival_rate, decay),
+        np.nan)
+    unfilled = np.clip(remaining - n_arrivals, 0, None)
+    return completion, unfilled
+
+
+def slot_cost(sizes, reward):
+    """Cost (reward + commission) of one assignment on HITs of the given
+    `sizes`"""
+    rate = np.where(sizes >= LARGE_HIT_SIZE, LARGE_HIT_FEE, FEE)
+    return reward + np.maximum(MIN_FEE, rate * reward)
+
+
+def fit_arrival_model(client, title, decay_grid=DECAY_GRID):
+    """Estimate `(arrival_rate, decay)` from the AcceptTimes on past HITs with
+    `title`. HITs are pooled per HIT group and split into posting rounds as in
+    `simulate`; arrivals are only observed while the group had open slots,
+    i.e. until the slots posted so far were all taken or the HITs expired"""
+    hit_fields = ['HITId', 'HITGroupId', 'Title', 'CreationTime', 'Expiration',
+                  'MaxAssignments']
+    hits = [h for h in iter_hits(client.list_hits, fields=hit_fields, MaxResults=100)
+            if h.Title == title]
+    if not hits:
+        raise ValueError('Cannot find any HITs with title `{}`'.format(title))
+
+    groups = {}
+    for hit in hits:
+        groups.setdefault(hit.HITGroupId, []).append(hit)
+
+    delays, windows = [], []
+    for group in groups.values():
+        start = min(h.CreationTime for h in group)
+
+        def _seconds(t):
+            return (t - start).total_seconds()
+
+        accepted = np.sort([
+            _seconds(a.AcceptTime)
+            for h in group
+            for a in iter_assignments(client, h.HITId, fields=['AcceptTime'])
+            if a.AcceptTime is not None])
+
+        posts, ends, capacity = _rounds(
+            np.array([_seconds(h.CreationTime) for h in group]),
+            np.array([h.MaxAssignments for h in group]),
+            max(_seconds(h.Expiration) for h in group))
+
+        n_filled = 0
+        for post, end, n_open in zip(posts, ends, capacity):
+            in_round = accepted[(accepted >= post) & (accepted <= end)]
+            in_round = in_round[:n_open - n_filled]
+
+            # once every open slot is taken, arrivals can't be observed
+            if len(in_round) and n_filled + len(in_round) >= n_open:
+                end = in_round[-1]
+
+            delays += list(in_round - post)
+            windows.append(end - post)
+            n_filled += len(in_round)
+
+    delays, windows = np.array(delays), np.array(windows)
+    if not len(delays):
+        raise ValueError('No accepted assignments found for `{}`'.format(title))
+
+    # profile likelihood over the decay grid: for a given decay, the MLE of
+    # the arrival rate is N / sum_i decay * (1 - exp(-T_i / decay))
+    decay = decay_grid[:, None]
+    exposure = (decay * -np.expm1(-windows[None, :] / decay)).sum(axis=1)
+    rates = len(delays) / exposure
+    log_lik = len(delays) * np.log(rates) - delays.sum() / decay_grid - len(delays)
+
+    best = np.argmax(log_lik)
+    return rates[best], decay_grid[best]
+
+
+def compare_schedules(n_assignments, reward, candidates, arrival_rate, decay,
+                      horizon, n_sims=5000, seed=None):
+    """Simulate every `(max_assignments, sleep_time)` candidate schedule and
+    return one summary dict per candidate"""
+    rng = np.random.default_rng(seed)
+    results = []
+    for max_assignments, sleep_time in candidates:
+        try:
+            times, sizes = posting_schedule(n_assignments, sleep_time, max_assignments)
+        except ValueError:
+            continue
+
+        completion, unfilled = simulate(
+            times, sizes, arrival_rate, decay, horizon, n_sims, rng)
+        done = completion[~np.isnan(completion)]
+
+        # workers take whichever slot is open, so each filled slot costs the
+        # average over the schedule's slots
+        costs = slot_cost(sizes, reward)
+        mean_cost = (costs * sizes).sum() / sizes.sum()
+
+        results.append({
+            'max_assignments': max_assignments,
+            'sleep_time': sleep_time,
+            'n_hits': len(sizes),
+            'p_complete': len(done) / float(n_sims),
+            'completion_p50': np.median(done) if len(done) else np.nan,
+            'completion_p90': np.percentile(done, 90) if len(done) else np.nan,
+            'unfilled_p50': np.percentile(unfilled, 50),
+            'unfilled_p90': np.percentile(unfilled, 90),
+            'unfilled_p99': np.percentile(unfilled, 99),
+            'max_cost': (costs * sizes).sum(),
+            'expected_cost': mean_cost * (sizes.sum() - unfilled.mean()),
+        })
+    return results
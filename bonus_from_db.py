@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import json
+import sqlite3
+from configparser import ConfigParser
+from concurrent.futures import ThreadPoolExecutor
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter
+
+import boto3
+
+from ledger import Ledger
+from rate_limiter import RateLimitedClient, CLIENT_CONFIG
+from profiling import add_profiling_arguments, start_profiling
+
+DESCRIPTION = """
+Bonus every participant in a psiturk study from the bonuses stored in its
+participants database.
+
+The completed, submitted and credited participants are read in chunks with a
+stable cursor (ordered by rowid), and each row is mapped to a (worker,
+assignment, amount) payment using its `bonus` column. If `--bonus_key` is given, participants without a bonus
+in that column have it read from `questiondata[<bonus_key>]` in their
+datastring; datastrings are only fetched and parsed for those rows.
+Assignments already bonused according to the ledger are skipped, and the rest
+are paid concurrently, once their assignment has been approved (according to
+the ledger or, failing that, MTurk).
+
+Usage
+-----
+Place in the same directory as the experiment's `config.txt` and run
+
+    >>> export AWS_ACCESS_KEY_ID=<MTurk access key id>
+    >>> export AWS_SECRET_ACCESS_KEY=<MTurk secret access key>
+    >>> bonus_from_db.py --dry_run
+    >>> bonus_from_db.py
+"""
+
+BONUS_REASON = 'Bonus for Gambling Experiment'
+
+# psiturk participant statuses. psiturk only marks participants CREDITED when
+# its own `worker approve` approves them, so the status column says nothing
+# about approvals made by the scripts here; payments are checked against the
+# ledger / MTurk instead
+STATUSES = {'completed': 3, 'submitted': 4, 'credited': 5}
+PAYABLE_STATUSES = ['completed', 'submitted', 'credited']
+
+
+class CustomFormatter(ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter):
+    pass
+
+
+def mturk_client():
+    print("Connecting to mechanical turk...")
+    key_id = os.environ['AWS_ACCESS_KEY_ID']
+    key = os.environ['AWS_SECRET_ACCESS_KEY']
+
+    client = boto3.client(
+        'mturk',
+        aws_access_key_id=key_id,
+        aws_secret_access_key=key,
+        config=CLIENT_CONFIG
+    )
+    return RateLimitedClient(client, account=key_id)
+
+
+def load_db_config(fp='config.txt'):
+    """Read the participants database path and table from the psiturk config"""
+    db, table = 'participants.db', 'turkdemo'
+    if os.path.lexists(fp):
+        config = ConfigParser()
+        config.read(fp)
+        if config.has_section('Database Parameters'):
+            section = config['Database Parameters']
+            url = section.get('database_url', 'sqlite:///' + db)
+            if not url.startswith('sqlite:///'):
+                raise ValueError(
+                    'Only sqlite databases are supported, got `{}`'.format(url))
+            db = url[len('sqlite:///'):]
+            table = section.get('table_name', table)
+    return db, table
+
+
+def iter_participants(conn, table, statuses, mode, chunk_size=1000):
+    """Yield chunks of `(rowid, worker, assignment, hit, bonus)` rows. Rows are
+    read in rowid order, so rows added while the script runs don't shift the
+    cursor"""
+    query = (
+        'SELECT rowid, workerid, assignmentid, hitid, bonus FROM "{}" '
+        'WHERE rowid > ? AND mode = ? AND status IN ({}) '
+        'ORDER BY rowid LIMIT ?'
+        .format(table, ', '.join('?' * len(statuses)))
+    )
+
+    last_rowid = 0
+    while True:
+        rows = conn.execute(
+            query, [last_rowid, mode] + list(statuses) + [chunk_size]).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_rowid = rows[-1][0]
+
+
+def datastring_bonus(conn, table, rowid, bonus_key):
+    row = conn.execute(
+        'SELECT datastring FROM "{}" WHERE rowid = ?'.format(table),
+        (rowid,)).fetchone()
+    if not row or not row[0]:
+        return None
+
+    data = json.loads(row[0])
+    return data.get('questiondata', {}).get(bonus_key)
+
+
+def payments(conn, table, ledger, statuses, mode, bonus_key=None, chunk_size=1000):
+    """Yield chunks of `(worker, assignment, hit, amount)` payments still owed"""
+    for rows in iter_participants(conn, table, statuses, mode, chunk_size):
+        chunk = []
+        for rowid, worker, assignment, hit, bonus in rows:
+            if ('bonus', assignment) in ledger:
+                continue
+
+            if not bonus and bonus_key:
+                bonus = datastring_bonus(conn, table, rowid, bonus_key)
+
+            try:
+                amount = round(float(bonus or 0), 2)
+            except ValueError:
+                print('\tInvalid bonus `{}` for worker {}, skipping'
+                      .format(bonus, worker))
+                continue
+
+            if amount > 0:
+                chunk.append((worker, assignment, hit, amount))
+        yield chunk
+
+
+def is_approved(client, ledger, assignment):
+    if ('approve', assignment) in ledger:
+        return True
+    ass = client.get_assignment(AssignmentId=assignment)['Assignment']
+    return ass['AssignmentStatus'] == 'Approved'
+
+
+def pay_bonus(client, ledger, payment, reason):
+    worker, assignment, hit, amount = payment
+    try:
+        if not is_approved(client, ledger, assignment):
+            print('\tSkipping worker {} on assignment {}: not approved yet'
+                  .format(worker, assignment))
+            return 0.
+
+        _ = client.send_bonus(
+            WorkerId=worker,
+            BonusAmount='{:.2f}'.format(amount),
+            AssignmentId=assignment,
+            Reason=reason,
+            UniqueRequestToken='bonus-{}'.format(assignment)
+        )
+    except Exception as e:
+        print('\tCould not bonus worker {} on assignment {}: {}'
+              .format(worker, assignment, e))
+        return 0.
+
+    ledger.add('bonus', assignment, worker_id=worker, hit_id=hit, amount=amount)
+    print('\tBonused worker {} on assignment {} with ${:.2f}'
+          .format(worker, assignment, amount))
+    return amount
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description=DESCRIPTION,
+        formatter_class=CustomFormatter)
+
+    parser.add_argument(
+        "--db",
+        type=str,
+        help="path to the psiturk sqlite database. default: from config.txt")
+
+    parser.add_argument(
+        "--table",
+        type=str,
+        help="name of the participants table. default: from config.txt")
+
+    parser.add_argument(
+        "--mode",
+        default="live",
+        type=str,
+        help="only bonus participants recorded in this psiturk mode")
+
+    parser.add_argument(
+        "--statuses",
+        nargs="+",
+        choices=sorted(STATUSES),
+        default=PAYABLE_STATUSES,
+        help="psiturk statuses of the participants to bonus. Whatever the "
+        "status, only approved assignments are paid")
+
+    parser.add_argument(
+        "--bonus_key",
+        metavar="KEY",
+        type=str,
+        help="questiondata key holding the bonus, used when the `bonus` "
+        "column is empty")
+
+    parser.add_argument(
+        "-r",
+        "--reason",
+        default=BONUS_REASON,
+        type=str,
+        help="reason for the bonus shown to the workers")
+
+    parser.add_argument(
+        "-n",
+        "--n_threads",
+        default=8,
+        type=int,
+        help="number of bonuses to send concurrently")
+
+    parser.add_argument(
+        "--chunk_size",
+        default=1000,
+        type=int,
+        help="number of participants to read from the database at a time")
+
+    parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        help="only list the bonuses that would be paid")
+
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    start_profiling(args)
+
+    db, table = load_db_config()
+    db, table = args.db or db, args.table or table
+
+    if not os.path.lexists(db):
+        raise FileNotFoundError('Cannot find psiturk database `{}`'.format(db))
+
+    conn = sqlite3.connect('file:{}?mode=ro'.format(db), uri=True)
+    ledger = Ledger()
+    client = None if args.dry_run else mturk_client()
+
+    n_paid, total = 0, 0.
+    with ThreadPoolExecutor(args.n_threads) as pool:
+        for chunk in payments(conn, table, ledger,
+                              [STATUSES[s] for s in args.statuses], args.mode,
+                              args.bonus_key, args.chunk_size):
+            if args.dry_run:
+                for worker, assignment, hit, amount in chunk:
+                    print('\tWould bonus worker {} on assignment {} with ${:.2f}{}'
+                          .format(worker, assignment, amount,
+                                  '' if ('approve', assignment) in ledger
+                                  else ' (if approved on MTurk)'))
+                amounts = [p[3] for p in chunk]
+            else:
+                amounts = list(pool.map(
+                    lambda p: pay_bonus(client, ledger, p, args.reason), chunk))
+
+            n_paid += sum(1 for a in amounts if a > 0)
+            total += sum(amounts)
+
+    print('\n{} {} bonuses totalling ${:.2f}'.format(
+        'Would pay' if args.dry_run else 'Paid', n_paid, total))
@@ -5,7 +5,11 @@ import sys
 from argparse import ArgumentParser, RawDescriptionHelpFormatter, ArgumentDefaultsHelpFormatter
 
 import boto3
-import numpy as np
+
+from ledger import Ledger
+from response_cache import CachedClient
+from rate_limiter import RateLimitedClient, CLIENT_CONFIG
+from profiling import add_profiling_arguments, start_profiling
 
 DESCRIPTION = """
 Bonus a worker.
@@ -43,45 +47,46 @@ def mturk_client():
     client = boto3.client(
         'mturk',
         aws_access_key_id=key_id,
-        aws_secret_access_key=key
+        aws_secret_access_key=key,
+        config=CLIENT_CONFIG
     )
-    return client
+    return CachedClient(RateLimitedClient(client, account=key_id))
 
 
-def bonus_worker(client, args, bonused_workers=set(), bonused_assignments=set()):
+def bonus_worker(client, args, ledger):
     assignments = client.list_assignments_for_hit(
         HITId=args.hit,
         MaxResults=100
     )
 
+    n_bonused = 0
     for ass in assignments['Assignments']:
         ass_id = ass['AssignmentId']
         worker_id = ass['WorkerId']
 
         if worker_id == args.worker:
+            if ('bonus', ass_id) in ledger:
+                print('\tWorker {} was already bonused on assignment {}'
+                      .format(args.worker, ass_id))
+                continue
+
             print('\tBonusing worker {} on assignment {} with ${:.2f}'
                   .format(args.worker, ass_id, args.bonus))
 
+            # the request token makes MTurk reject a duplicate bonus sent by
+            # a concurrent process before either has written to the ledger
             _ = client.send_bonus(
                 WorkerId=args.worker,
                 BonusAmount='{:.2f}'.format(args.bonus),
                 AssignmentId=ass_id,
-                Reason='Bonus for Gambling Experiment'
+                Reason=args.reason,
+                UniqueRequestToken='bonus-{}'.format(ass_id)
             )
 
-            bonused_workers.add(worker_id)
-            bonused_assignments.add(ass_id)
-    return bonused_workers, bonused_assignments
-
-
-def load_roster():
-    bonused_workers = set()
-    bonused_assignments = set()
-    if os.path.lexists('bonused.npz'):
-        bonused = np.load('bonused.npz')
-        bonused_workers = set(bonused['bonused_workers'])
-        bonused_assignments = set(bonused['bonused_assignments'])
-    return bonused_workers, bonused_assignments
+            ledger.add('bonus', ass_id, worker_id=worker_id,
+                       hit_id=args.hit, amount=args.bonus)
+            n_bonused += 1
+    return n_bonused
 
 
 if __name__ == "__main__":
@@ -107,10 +112,19 @@ if __name__ == "__main__":
         metavar="BONUS",
         help="The amount to bonus the worker (in USD)")
 
+    parser.add_argument(
+        '-r',
+        '--reason',
+        default='Bonus for Gambling Experiment',
+        type=str,
+        help="reason for the bonus shown to the worker")
+
+    add_profiling_arguments(parser)
     args = parser.parse_args()
+    start_profiling(args)
 
-    # try loading the info on already-bonused HIT from previous runs
-    bonused_workers, bonused_assignments = load_roster()
+    # try loading the info on already-bonused assignments from previous runs
+    ledger = Ledger()
 
     client = mturk_client()
 
@@ -120,14 +134,4 @@ if __name__ == "__main__":
         print('Could not find HIT ID `{}`'.format(args.hit))
         sys.exit()
 
-    already_done = args.worker in bonused_workers
-
-    if not already_done:
-        bonused_workers, bonused_assignments = bonus_worker(
-            client, args, bonused_workers, bonused_assignments)
-
-        np.savez(
-            'bonused.npz',
-            bonused_workers=np.array(list(bonused_workers)),
-            bonused_assignments=np.array(list(bonused_assignments)),
-        )
+    bonus_worker(client, args, ledger)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter
+
+import boto3
+
+from ledger import Ledger
+from rate_limiter import RateLimitedClient, CLIENT_CONFIG
+from profiling import add_profiling_arguments, start_profiling
+
+DESCRIPTION = """
+Archive and delete fully reviewed HITs so that the live HIT listing (and every
+`list_hits` / `list_reviewable_hits` scan made by the other scripts) only holds
+active work.
+
+A HIT is compacted when it is Reviewable, has no pending assignments, and all
+of its assignments have been approved or rejected. With `--require_bonuses`,
+HITs with approved assignments that have no bonus recorded in the ledger are
+kept too, since bonus_worker.py can no longer find a deleted HIT's
+assignments. The HIT record, assignment
+records and bonus payments are written to `<ARCHIVE>/<HIT ID>.json` before
+`delete_hit` is called, so no data is lost.
+
+Usage
+-----
+    >>> export AWS_ACCESS_KEY_ID=<MTurk access key id>
+    >>> export AWS_SECRET_ACCESS_KEY=<MTurk secret access key>
+    >>> compact_hits.py -t <HIT title>
+"""
+
+REVIEWED_STATUSES = ['Approved', 'Rejected']
+
+
+class CustomFormatter(ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter):
+    pass
+
+
+def all_pages(func, **kwargs):
+    """Handle pagination for boto3 AWS requests"""
+    response = func(**kwargs)
+    pages = [response]
+    while response['NumResults'] > 0:
+        response = func(
+            NextToken=response['NextToken'],
+            **kwargs
+        )
+        pages += [response]
+    return pages
+
+
+def mturk_client():
+    print("Connecting to mechanical turk...")
+    key_id = os.environ['AWS_ACCESS_KEY_ID']
+    key = os.environ['AWS_SECRET_ACCESS_KEY']
+
+    client = boto3.client(
+        'mturk',
+        aws_access_key_id=key_id,
+        aws_secret_access_key=key,
+        config=CLIENT_CONFIG
+    )
+    return RateLimitedClient(client, account=key_id)
+
+
+def archive_hit(hit, assignments, bonuses, archive_dir):
+    fp = os.path.join(archive_dir, '{}.json'.format(hit['HITId']))
+    tmp = fp + '.tmp'
+    with open(tmp, 'w') as handle:
+        json.dump({'HIT': hit, 'Assignments': assignments,
+                   'BonusPayments': bonuses}, handle, default=str, indent=1)
+    os.replace(tmp, fp)
+    return fp
+
+
+def compact_hit(client, hit, archive_dir, ledger, require_bonuses=False,
+                dry_run=False):
+    """Archive and delete `hit` if it is fully reviewed (and, if
+    `require_bonuses`, bonused). Returns True if the HIT was (or, for a dry
+    run, would have been) deleted"""
+    if hit.get('NumberOfAssignmentsPending', 0) > 0:
+        return False
+
+    pages = all_pages(
+        client.list_assignments_for_hit,
+        HITId=hit['HITId'],
+        MaxResults=100
+    )
+    assignments = [a for page in pages for a in page['Assignments']]
+
+    if any(a['AssignmentStatus'] not in REVIEWED_STATUSES for a in assignments):
+        return False
+
+    unbonused = [a['AssignmentId'] for a in assignments
+                 if a['AssignmentStatus'] == 'Approved'
+                 and ('bonus', a['AssignmentId']) not in ledger]
+    if unbonused and require_bonuses:
+        print('\tKeeping HIT {}: {} approved assignments have not been bonused'
+              .format(hit['HITId'], len(unbonused)))
+        return False
+
+    if dry_run:
+        print('\tWould delete HIT {} ({} assignments)'
+              .format(hit['HITId'], len(assignments)))
+        return True
+
+    pages = all_pages(
+        client.list_bonus_payments,
+        HITId=hit['HITId'],
+        MaxResults=100
+    )
+    bonuses = [b for page in pages for b in page['BonusPayments']]
+
+    fp = archive_hit(hit, assignments, bonuses, archive_dir)
+    try:
+        client.delete_hit(HITId=hit['HITId'])
+    except Exception as e:
+        print('\tCould not delete HIT {} (archived to `{}`): {}'
+              .format(hit['HITId'], fp, e))
+        return False
+
+    print('\tArchived and deleted HIT {} ({} assignments)'
+          .format(hit['HITId'], len(assignments)))
+    return True
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description=DESCRIPTION,
+        formatter_class=CustomFormatter)
+
+    parser.add_argument(
+        '-t',
+        "--title",
+        metavar="TITLE",
+        type=str,
+        help="only compact HITs with this title. default: all HITs")
+
+    parser.add_argument(
+        '-a',
+        "--archive",
+        default="hit_archive",
+        type=str,
+        help="directory to archive the HIT and assignment records to")
+
+    parser.add_argument(
+        '-n',
+        "--n_threads",
+        default=8,
+        type=int,
+        help="number of HITs to process concurrently")
+
+    parser.add_argument(
+        '-l',
+        "--ledger",
+        default="ledger.tsv",
+        type=str,
+        help="path to the payment ledger")
+
+    parser.add_argument(
+        "--require_bonuses",
+        action="store_true",
+        help="keep HITs whose approved assignments have no bonus in the ledger")
+
+    parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        help="only list the HITs that would be deleted")
+
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    start_profiling(args)
+
+    if not os.path.isdir(args.archive):
+        os.makedirs(args.archive)
+
+    ledger = Ledger(args.ledger)
+    client = mturk_client()
+
+    print('Retrieving reviewable HITs...')
+    pages = all_pages(
+        client.list_reviewable_hits,
+        Status='Reviewable',
+        MaxResults=100
+    )
+
+    hits = [h for page in pages for h in page['HITs']
+            if not args.title or h['Title'] == args.title]
+
+    print('Checking {} reviewable HITs...'.format(len(hits)))
+    with ThreadPoolExecutor(args.n_threads) as pool:
+        deleted = list(pool.map(
+            lambda hit: compact_hit(client, hit, args.archive, ledger,
+                                    args.require_bonuses, args.dry_run),
+            hits
+        ))
+
+    print('\n{} {} of {} reviewable HITs'.format(
+        'Would delete' if args.dry_run else 'Deleted', sum(deleted), len(hits)))
@@ -6,6 +6,9 @@ from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, RawDescripti
 import boto3
 import numpy as np
 
+from rate_limiter import RateLimitedClient, CLIENT_CONFIG
+from profiling import add_profiling_arguments, start_profiling
+
 DESCRIPTION = \
     """
 Create a new worker qualification. Useful in preparation for making
@@ -44,9 +47,10 @@ def mturk_client():
     client = boto3.client(
         'mturk',
         aws_access_key_id=key_id,
-        aws_secret_access_key=key
+        aws_secret_access_key=key,
+        config=CLIENT_CONFIG
     )
-    return client
+    return RateLimitedClient(client, account=key_id)
 
 
 if __name__ == "__main__":
@@ -68,7 +72,9 @@ if __name__ == "__main__":
         help="long description for the qualification. this is "
         "displayed when a worker examines the qualification")
 
+    add_profiling_arguments(parser)
     args = parser.parse_args()
+    start_profiling(args)
 
     client = mturk_client()
 
@@ -2,10 +2,15 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter
 
 import boto3
 
+from records import iter_hits, iter_assignments
+from rate_limiter import RateLimitedClient, CLIENT_CONFIG
+from profiling import add_profiling_arguments, start_profiling
+
 DESCRIPTION = """
 Print a list of the worker IDs associated with a given HIT or HIT set. If the
 `--worker` flag is passed, searches for the passed worker ID within the list
@@ -16,6 +21,12 @@ Usage
     >>> export AWS_ACCESS_KEY_ID=<MTurk access key id>
     >>> export AWS_SECRET_ACCESS_KEY=<MTurk secret access key>
     >>> get_workers_for_hit.py --hit <HIT ID / HIT Set Id> --worker <>
+
+To look up many HITs / HIT sets / workers at once, list them in a file with one
+`hit <ID>`, `group <ID>` or `worker <ID>` entry per line and run
+    >>> get_workers_for_hit.py --batch <file>
+All queries share a single pass over the HIT listing, assignments are fetched
+concurrently, and the results are printed as a single table.
 """
 
 
@@ -49,9 +60,10 @@ def mturk_client(print_msg=False, key_id=None, key=None):
     client = boto3.client(
         'mturk',
         aws_access_key_id=key_id,
-        aws_secret_access_key=key
+        aws_secret_access_key=key,
+        config=CLIENT_CONFIG
     )
-    return client
+    return RateLimitedClient(client, account=key_id)
 
 
 def get_workers_for_hit(hit_id=None, hit_group=None, worker=None, print_msg=False):
@@ -68,10 +80,10 @@ def get_workers_for_hit(hit_id=None, hit_group=None, worker=None, print_msg=Fals
 
     if hit_id:
         key = 'HITId'
-        value = args.hit
+        value = hit_id
     elif hit_group:
         key = 'HITGroupId'
-        value = args.hit_group
+        value = hit_group
 
     for page in pages:
         result = [r for r in page['HITs'] if r[key] == value]
@@ -116,6 +128,76 @@ def get_workers_for_hit(hit_id=None, hit_group=None, worker=None, print_msg=Fals
     return asgn_tuples
 
 
+def load_batch(fp):
+    queries = {'hit': set(), 'group': set(), 'worker': set()}
+    with open(fp, 'r') as handle:
+        for ix, line in enumerate(handle):
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+
+            fields = line.split()
+            if len(fields) != 2 or fields[0] not in queries:
+                raise ValueError('Invalid entry on line {} of `{}`: {}'
+                                 .format(ix + 1, fp, line))
+            queries[fields[0]].add(fields[1])
+    return queries
+
+
+def get_workers_for_hits(hit_ids=(), hit_groups=(), workers=(), n_threads=8,
+                         print_msg=False):
+    """Batch version of `get_workers_for_hit`. Returns a list of
+    `[hit_id, hit_group, worker_id, status, submit_time]` rows for every
+    assignment on the matching HITs (restricted to `workers`, if given),
+    along with the HIT IDs (`missing['hit']`) and HIT group IDs
+    (`missing['group']`) that could not be found.
+    If no HITs or HIT groups are given, every HIT is searched for `workers`"""
+    client = mturk_client(print_msg)
+    hit_ids, hit_groups, workers = set(hit_ids), set(hit_groups), set(workers)
+    match_all = not hit_ids and not hit_groups
+
+    if print_msg:
+        print('Retrieving HITs...')
+
+    # a single pass over the HIT listing serves every query
+    hits, found_hits, found_groups = [], set(), set()
+    fields = ['HITId', 'HITGroupId']
+    for hit in iter_hits(client.list_hits, fields=fields, MaxResults=100):
+        if match_all or hit.HITId in hit_ids or hit.HITGroupId in hit_groups:
+            hits.append(hit)
+            found_hits.add(hit.HITId)
+            found_groups.add(hit.HITGroupId)
+
+            if hit_ids and not hit_groups and hit_ids <= found_hits:
+                break
+
+    def _assignments(hit):
+        rows = []
+        fields = ['WorkerId', 'AssignmentStatus', 'SubmitTime']
+        for assignment in iter_assignments(client, hit.HITId, fields=fields):
+            if workers and assignment.WorkerId not in workers:
+                continue
+            rows.append([
+                hit.HITId,
+                hit.HITGroupId,
+                assignment.WorkerId,
+                assignment.AssignmentStatus,
+                assignment.SubmitTime.strftime('%D %I:%M:%S %p'),
+            ])
+        return rows
+
+    if print_msg:
+        print('Searching Worker IDs for {} HITs...'.format(len(hits)))
+
+    asgn_tuples = []
+    with ThreadPoolExecutor(n_threads) as pool:
+        for rows in pool.map(_assignments, hits):
+            asgn_tuples += rows
+
+    missing = {'hit': hit_ids - found_hits, 'group': hit_groups - found_groups}
+    return asgn_tuples, missing
+
+
 if __name__ == "__main__":
     parser = ArgumentParser(
         description=DESCRIPTION,
@@ -139,7 +221,53 @@ if __name__ == "__main__":
         type=str,
         help="worker ID to look for")
 
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        type=str,
+        help="file listing `hit <ID>`, `group <ID>` and `worker <ID>` queries")
+
+    parser.add_argument(
+        "--n_threads",
+        default=8,
+        type=int,
+        help="number of HITs to fetch assignments for concurrently (--batch only)")
+
+    add_profiling_arguments(parser)
     args = parser.parse_args()
+    start_profiling(args)
+
+    if args.batch:
+        queries = load_batch(args.batch)
+        if args.hit:
+            queries['hit'].add(args.hit)
+        if args.hit_group:
+            queries['group'].add(args.hit_group)
+        if args.worker:
+            queries['worker'].add(args.worker)
+
+        asgn_tuples, missing = get_workers_for_hits(
+            hit_ids=queries['hit'],
+            hit_groups=queries['group'],
+            workers=queries['worker'],
+            n_threads=args.n_threads,
+            print_msg=True
+        )
+
+        print('\n' + '\t'.join(['HITId', 'HITGroupId', 'WorkerId', 'Status', 'SubmitTime']))
+        for asgn_tuple in sorted(asgn_tuples):
+            print('\t'.join(asgn_tuple))
+
+        for value in sorted(missing['hit']):
+            print('Could not find a HIT with HITId `{}`'.format(value))
+        for value in sorted(missing['group']):
+            print('Could not find a HIT with HITGroupId `{}`'.format(value))
+
+        if queries['worker']:
+            found = set(t[2] for t in asgn_tuples)
+            for worker in sorted(queries['worker'] - found):
+                print('Could not find worker `{}`'.format(worker))
+        sys.exit()
 
     if not args.hit and not args.hit_group:
         print('Error: You must specify either --hit or --hit_group')
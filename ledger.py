@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only ledger of the approvals and bonuses we have paid, shared by the
+approve / bonus scripts.
+
+Each record is keyed by `(kind, key)`, where `kind` is one of `approve`,
+`bonus` or `hit` and `key` is the assignment ID (or the HIT ID for `hit`
+records). Records are appended to a tab-separated file under an exclusive
+`flock`, and readers take a shared lock, so any number of processes can read
+and append to the same ledger at once without losing each other's records.
+
+Rosters written by earlier versions of the scripts (`credited.npz`,
+`bonused.npz`) are read as a read-only starting point.
+"""
+import os
+import time
+import fcntl
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+LEDGER_FILE = 'ledger.tsv'
+LEGACY_FILES = ['credited.npz', 'bonused.npz']
+FIELDS = ['kind', 'key', 'worker_id', 'hit_id', 'amount', 'timestamp']
+
+# map the arrays in the legacy .npz rosters to ledger kinds
+LEGACY_KINDS = {
+    'credited_hits': 'hit',
+    'credited_assignments': 'approve',
+    'bonused_assignments': 'bonus',
+}
+LEGACY_WORKERS = ['credited_workers', 'bonused_workers']
+
+
+class Ledger(object):
+    def __init__(self, fp=LEDGER_FILE, legacy=LEGACY_FILES):
+        self.fp = fp
+        self._records = {}
+        self._workers = set()
+        self._offset = 0
+        self._lock = threading.RLock()
+
+        for legacy_fp in legacy:
+            self._load_legacy(legacy_fp)
+        self.refresh()
+
+    def __contains__(self, kind_key):
+        return kind_key in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def _load_legacy(self, fp):
+        if not os.path.lexists(fp):
+            return
+
+        roster = np.load(fp)
+        for name, kind in LEGACY_KINDS.items():
+            if name in roster:
+                for key in roster[name].tolist():
+                    self._records[(kind, key)] = {'kind': kind, 'key': key}
+
+        for name in LEGACY_WORKERS:
+            if name in roster:
+                self._workers.update(roster[name].tolist())
+
+    @contextmanager
+    def _locked(self, exclusive=False):
+        # the thread lock guards our in-memory state, the file lock guards
+        # the ledger file against other processes
+        with self._lock, open(self.fp, 'a+b') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield handle
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _read_new(self, handle):
+        handle.seek(self._offset)
+        for line in handle:
+            # only consume complete lines
+            if not line.endswith(b'\n'):
+                break
+            self._offset += len(line)
+
+            values = line.decode('utf-8').rstrip('\n').split('\t')
+            record = dict(zip(FIELDS, values))
+            self._records[(record['kind'], record['key'])] = record
+            if record.get('worker_id'):
+                self._workers.add(record['worker_id'])
+
+    def refresh(self):
+        """Read the records appended by other processes since the last read"""
+        if not os.path.lexists(self.fp):
+            return
+        with self._locked() as handle:
+            self._read_new(handle)
+
+    def add(self, kind, key, worker_id='', hit_id='', amount=''):
+        """Append a record. Returns False without writing anything if a record
+        for `(kind, key)` already exists"""
+        with self._locked(exclusive=True) as handle:
+            self._read_new(handle)
+            if (kind, key) in self._records:
+                return False
+
+            values = [kind, key, worker_id or '', hit_id or '',
+                      '' if amount in (None, '') else '{:.2f}'.format(float(amount)),
+                      '{:.3f}'.format(time.time())]
+            handle.write(('\t'.join(values) + '\n').encode('utf-8'))
+            handle.flush()
+            os.fsync(handle.fileno())
+            self._read_new(handle)
+        return True
+
+    def keys(self, kind):
+        with self._lock:
+            return set(key for (k, key) in self._records if k == kind)
+
+    def records(self, kind=None):
+        with self._lock:
+            return [r for (k, _), r in self._records.items()
+                    if kind is None or k == kind]
+
+    def workers(self, kind=None):
+        """Worker IDs recorded in the ledger (and in any legacy rosters)"""
+        if kind is None:
+            with self._lock:
+                return set(self._workers)
+        return set(r['worker_id'] for r in self.records(kind)
+                   if r.get('worker_id'))
@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import csv
+import sys
+import time
+from configparser import ConfigParser
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter
+
+import boto3
+
+from ledger import Ledger
+from records import iter_hits, iter_assignments
+from rate_limiter import (RateLimitedClient, SharedRateLimiter, load_budgets,
+                          DEFAULT_BUDGETS, CLIENT_CONFIG)
+from approve_hit import credit_hit
+from profiling import add_profiling_arguments, start_profiling, profile_call
+
+DESCRIPTION = """
+Run approve / bonus / export across several MTurk requester accounts at once.
+
+Accounts are read from a profile file in the same format as
+`~/.aws/credentials`, with one section per account:
+
+    [lab-main]
+    aws_access_key_id = <MTurk access key id>
+    aws_secret_access_key = <MTurk secret access key>
+    title = <default HIT title for `approve`>    (optional)
+    max_calls_per_second = 5                     (optional)
+    n_threads = 4                                (optional)
+
+Each account is handled by its own worker process, with its own client,
+thread pool and rate budget, and keeps its own ledger (`ledger_<account>.tsv`).
+`max_calls_per_second` sets the account-wide budget of the shared rate limiter
+(0 for no limit). It is stored with the limiter's state, so any other script
+running against the account refills at the same rate; without it, the budgets
+in `rate_limits.json` (or already in use for the account) apply.
+The per-account results are merged into a single report, so the total run time
+is set by the largest account rather than the sum of all of them.
+
+Usage
+-----
+    >>> multi_account.py -p accounts.ini approve -t <HIT title>
+    >>> multi_account.py -p accounts.ini bonus bonuses.csv
+    >>> multi_account.py -p accounts.ini export -o assignments.csv
+
+The `bonus` file is a CSV with the columns `account,worker,hit,bonus`.
+"""
+
+DEFAULT_THREADS = 4
+BONUS_REASON = 'Bonus for Gambling Experiment'
+
+EXPORT_FIELDS = ['account', 'hit_id', 'title', 'worker_id',
+                 'assignment_id', 'status', 'submit_time']
+
+
+class CustomFormatter(ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter):
+    pass
+
+
+def mturk_client(print_msg=False, key_id=None, key=None):
+    if print_msg:
+        print("Connecting to mechanical turk...")
+
+    if not key_id:
+        key_id = os.environ['AWS_ACCESS_KEY_ID']
+
+    if not key:
+        key = os.environ['AWS_SECRET_ACCESS_KEY']
+
+    client = boto3.client(
+        'mturk',
+        aws_access_key_id=key_id,
+        aws_secret_access_key=key,
+        config=CLIENT_CONFIG
+    )
+    return client
+
+
+def load_profiles(fp, names=None):
+    if not os.path.lexists(fp):
+        raise FileNotFoundError('Cannot find profile file `{}`'.format(fp))
+
+    config = ConfigParser()
+    config.read(fp)
+
+    accounts = []
+    for name in config.sections():
+        if names and name not in names:
+            continue
+
+        section = config[name]
+        accounts.append({
+            'name': name,
+            'key_id': section['aws_access_key_id'],
+            'key': section['aws_secret_access_key'],
+            'title': section.get('title'),
+            'rate': section.getfloat('max_calls_per_second'),
+            'n_threads': section.getint('n_threads', DEFAULT_THREADS),
+        })
+
+    missing = set(names or []) - set(a['name'] for a in accounts)
+    if missing:
+        raise ValueError('Unknown account(s) in `{}`: {}'
+                         .format(fp, ', '.join(sorted(missing))))
+    return accounts
+
+
+def account_ledger(account):
+    legacy = ['credited_{}.npz'.format(account), 'bonused_{}.npz'.format(account)]
+    return Ledger('ledger_{}.tsv'.format(account), legacy=legacy)
+
+
+def approve_account(client, account, options):
+    title = options.get('title') or account['title']
+    if not title:
+        raise ValueError('No HIT title given for account `{}`'
+                         .format(account['name']))
+
+    ledger = account_ledger(account['name'])
+
+    hits = iter_hits(
+        client.list_reviewable_hits,
+        fields=['HITId'],
+        Status='Reviewable',
+        MaxResults=100
+    )
+    hit_ids = [h.HITId for h in hits if ('hit', h.HITId) not in ledger]
+
+    def _credit(hit_id):
+        hit = client.get_hit(HITId=hit_id)['HIT']
+        if hit['Title'] != title:
+            return 0
+        n_credited = credit_hit(client, hit_id, ledger)
+        ledger.add('hit', hit_id)
+        return n_credited
+
+    with ThreadPoolExecutor(account['n_threads']) as pool:
+        n_approved = sum(pool.map(_credit, hit_ids))
+    return {'approved': n_approved}
+
+
+def bonus_account(client, account, options):
+    ledger = account_ledger(account['name'])
+    rows = [r for r in options['bonuses'] if r['account'] == account['name']]
+
+    def _bonus(row):
+        assignments = client.list_assignments_for_hit(
+            HITId=row['hit'],
+            MaxResults=100
+        )
+
+        n_bonused = 0
+        for ass in assignments['Assignments']:
+            ass_id = ass['AssignmentId']
+            if ass['WorkerId'] != row['worker'] or ('bonus', ass_id) in ledger:
+                continue
+
+            print('\t[{}] Bonusing worker {} on assignment {} with ${:.2f}'
+                  .format(account['name'], row['worker'],
+                          ass_id, float(row['bonus'])))
+
+            _ = client.send_bonus(
+                WorkerId=row['worker'],
+                BonusAmount='{:.2f}'.format(float(row['bonus'])),
+                AssignmentId=ass_id,
+                Reason=options['reason'],
+                UniqueRequestToken='bonus-{}'.format(ass_id)
+            )
+            ledger.add('bonus', ass_id, worker_id=row['worker'],
+                       hit_id=row['hit'], amount=row['bonus'])
+            n_bonused += 1
+        return n_bonused
+
+    with ThreadPoolExecutor(account['n_threads']) as pool:
+        n_bonused = sum(pool.map(_bonus, rows))
+    return {'bonused': n_bonused}
+
+
+def export_account(client, account, options):
+    title = options.get('title')
+    hits = [h for h in iter_hits(client.list_hits, fields=['HITId', 'Title'],
+                                 MaxResults=100)
+            if not title or h.Title == title]
+
+    def _assignments(hit):
+        rows = []
+        for ass in iter_assignments(client, hit.HITId):
+            rows.append([
+                account['name'], hit.HITId, hit.Title,
+                ass.WorkerId, ass.AssignmentId, ass.AssignmentStatus,
+                ass.SubmitTime.strftime('%D %I:%M:%S %p'),
+            ])
+        return rows
+
+    rows = []
+    with ThreadPoolExecutor(account['n_threads']) as pool:
+        for hit_rows in pool.map(_assignments, hits):
+            rows += hit_rows
+    return {'hits': len(hits), 'assignments': len(rows), 'rows': rows}
+
+
+COMMANDS = {
+    'approve': approve_account,
+    'bonus': bonus_account,
+    'export': export_account,
+}
+
+
+def run_account(task):
+    command, account, options = task
+    if options.get('profile'):
+        # profile each account in its own process and stats file
+        fp = '{}.{}'.format(options['profile'], account['name'])
+        return profile_call(fp, _run_account, command, account, options)
+    return _run_account(command, account, options)
+
+
+def _run_account(command, account, options):
+    print('[{}] Running `{}`...'.format(account['name'], command))
+
+    start = time.time()
+    result = {'account': account['name'], 'error': None}
+    try:
+        budgets = None
+        if account['rate'] is not None:
+            budgets = dict(load_budgets() or DEFAULT_BUDGETS)
+            budgets['*'] = (account['rate'], 2 * account['rate'])
+        client = RateLimitedClient(
+            mturk_client(key_id=account['key_id'], key=account['key']),
+            SharedRateLimiter(account['key_id'], budgets)
+        )
+        result.update(COMMANDS[command](client, account, options))
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    result['elapsed'] = time.time() - start
+    return result
+
+
+def print_report(command, results):
+    columns = {
+        'approve': ['approved'],
+        'bonus': ['bonused'],
+        'export': ['hits', 'assignments'],
+    }[command]
+
+    print('\n{:<20}'.format('account') +
+          ''.join('{:>12}'.format(c) for c in columns + ['seconds']))
+
+    totals = dict((c, 0) for c in columns)
+    for res in sorted(results, key=lambda r: r['account']):
+        line = '{:<20}'.format(res['account'])
+        for c in columns:
+            totals[c] += res.get(c, 0)
+            line += '{:>12}'.format(res.get(c, 0))
+        line += '{:>12.1f}'.format(res['elapsed'])
+        if res['error']:
+            line += '  ERROR {}'.format(res['error'])
+        print(line)
+
+    wall = max([r['elapsed'] for r in results] + [0])
+    print('{:<20}'.format('TOTAL') +
+          ''.join('{:>12}'.format(totals[c]) for c in columns) +
+          '{:>12.1f}'.format(wall))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description=DESCRIPTION,
+        formatter_class=CustomFormatter)
+
+    parser.add_argument(
+        "-p",
+        "--profiles",
+        default="accounts.ini",
+        type=str,
+        help="profile file listing the requester accounts")
+
+    parser.add_argument(
+        "-a",
+        "--account",
+        dest="accounts",
+        action="append",
+        metavar="NAME",
+        help="only run for this account (can be repeated). default: all")
+
+    parser.add_argument(
+        "-n",
+        "--n_processes",
+        default=None,
+        type=int,
+        help="number of worker processes. default: one per account")
+
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+    subparsers.required = True
+
+    approve = subparsers.add_parser(
+        "approve",
+        formatter_class=CustomFormatter,
+        help="approve reviewable HITs with a given title")
+    approve.add_argument(
+        "-t",
+        "--title",
+        metavar="TITLE",
+        type=str,
+        help="title of the experiment/HIT. default: the account's `title`")
+
+    bonus = subparsers.add_parser(
+        "bonus",
+        formatter_class=CustomFormatter,
+        help="bonus the workers listed in a CSV file")
+    bonus.add_argument(
+        "bonus_file",
+        metavar="BONUS_FILE",
+        type=str,
+        help="CSV file with columns `account,worker,hit,bonus`")
+    bonus.add_argument(
+        "-r",
+        "--reason",
+        default=BONUS_REASON,
+        type=str,
+        help="reason for the bonus shown to the workers")
+
+    export = subparsers.add_parser(
+        "export",
+        formatter_class=CustomFormatter,
+        help="export all assignments to a single CSV file")
+    export.add_argument(
+        "-t",
+        "--title",
+        metavar="TITLE",
+        type=str,
+        help="only export HITs with this title")
+    export.add_argument(
+        "-o",
+        "--output",
+        default="assignments.csv",
+        type=str,
+        help="path of the CSV file to write")
+
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    start_profiling(args)
+
+    accounts = load_profiles(args.profiles, args.accounts)
+    if not accounts:
+        print('Error: No accounts found in `{}`'.format(args.profiles))
+        sys.exit()
+
+    options = {'title': getattr(args, 'title', None), 'profile': args.profile}
+    if args.command == 'bonus':
+        with open(args.bonus_file, 'r') as handle:
+            options['bonuses'] = list(csv.DictReader(handle))
+        options['reason'] = args.reason
+
+    tasks = [(args.command, account, options) for account in accounts]
+    n_processes = args.n_processes or len(accounts)
+
+    with Pool(min(n_processes, len(accounts))) as pool:
+        results = list(pool.imap_unordered(run_account, tasks))
+
+    if args.command == 'export':
+        with open(args.output, 'w', newline='') as handle:
+            writer = csv.writer(handle)
+            writer.writerow(EXPORT_FIELDS)
+            for res in results:
+                writer.writerows(res.pop('rows', []))
+        print('\nWrote assignments to `{}`'.format(args.output))
+
+    print_report(args.command, results)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sys
+from glob import glob
+from concurrent.futures import ThreadPoolExecutor
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter
+
+import boto3
+import numpy as np
+
+from ledger import Ledger
+from records import iter_hits, iter_assignments
+from rate_limiter import RateLimitedClient, CLIENT_CONFIG
+from profiling import add_profiling_arguments, start_profiling
+
+DESCRIPTION = """
+Maintain a compact index of every worker we have ever paid, to keep returning
+subjects out of new studies.
+
+The index is a sorted array of fixed-width byte strings saved as a `.npy`
+file. It is memory-mapped on load and queried by binary search, so millions
+of worker IDs take up a few MB and load instantly. `update` merges the worker
+IDs from the local ledgers (`ledger*.tsv`), legacy rosters (`credited*.npz`,
+`bonused*.npz`) and, optionally, the assignments of HITs with a given title.
+With `--grant`, the exclusion qualification is assigned only to workers that
+have not yet been granted it by a previous run.
+
+Usage
+-----
+    >>> export AWS_ACCESS_KEY_ID=<MTurk access key id>
+    >>> export AWS_SECRET_ACCESS_KEY=<MTurk secret access key>
+    >>> participant_index.py update --grant <qualification id>
+    >>> participant_index.py check <worker id> <worker id> ...
+"""
+
+INDEX_FILE = 'participants.npy'
+LEDGER_FILES = ['ledger*.tsv']
+ROSTER_FILES = ['credited*.npz', 'bonused*.npz']
+ROSTER_KEYS = ['credited_workers', 'bonused_workers']
+
+
+class CustomFormatter(ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter):
+    pass
+
+
+def mturk_client():
+    print("Connecting to mechanical turk...")
+    key_id = os.environ['AWS_ACCESS_KEY_ID']
+    key = os.environ['AWS_SECRET_ACCESS_KEY']
+
+    client = boto3.client(
+        'mturk',
+        aws_access_key_id=key_id,
+        aws_secret_access_key=key,
+        config=CLIENT_CONFIG
+    )
+    return RateLimitedClient(client, account=key_id)
+
+
+def to_ids(worker_ids):
+    """Convert an iterable of worker IDs to a sorted, unique byte-string array"""
+    ids = np.asarray(list(worker_ids)).astype(np.bytes_)
+    return np.unique(ids)
+
+
+def load_index(fp=INDEX_FILE):
+    if not os.path.lexists(fp):
+        return np.array([], dtype='S1')
+    return np.load(fp, mmap_mode='r')
+
+
+def save_index(ids, fp=INDEX_FILE):
+    # write to a temporary file first so readers never see a partial index
+    tmp = fp + '.tmp.npy'
+    np.save(tmp, ids)
+    os.replace(tmp, fp)
+
+
+def contains(index, worker_ids):
+    """Return a boolean mask of which `worker_ids` are present in `index`"""
+    ids = np.asarray(worker_ids).astype(np.bytes_)
+    if not len(index):
+        return np.zeros(len(ids), dtype=bool)
+
+    # compare at the index width so longer queries don't match a prefix
+    width = max(index.dtype.itemsize, ids.dtype.itemsize)
+    ids = ids.astype('S{}'.format(width))
+    ix = np.searchsorted(index, ids)
+    ix[ix == len(index)] = 0
+    return index[ix] == ids
+
+
+def difference(ids, index):
+    """Return the entries of the sorted array `ids` that are not in `index`"""
+    return ids[~contains(index, ids)]
+
+
+def merge(index, ids):
+    width = max(index.dtype.itemsize, ids.dtype.itemsize)
+    dtype = 'S{}'.format(width)
+    return np.union1d(index.astype(dtype), ids.astype(dtype))
+
+
+def ledger_workers():
+    worker_ids = set()
+    for pattern in LEDGER_FILES:
+        for fp in glob(pattern):
+            worker_ids |= Ledger(fp, legacy=[]).workers()
+
+    for pattern in ROSTER_FILES:
+        for fp in glob(pattern):
+            roster = np.load(fp)
+            for key in ROSTER_KEYS:
+                if key in roster:
+                    worker_ids.update(roster[key].tolist())
+    return worker_ids
+
+
+def hit_workers(client, title):
+    hits = iter_hits(client.list_hits, fields=['HITId', 'Title'], MaxResults=100)
+    hit_ids = [h.HITId for h in hits if h.Title == title]
+
+    worker_ids = set()
+    for hit_id in hit_ids:
+        assignments = iter_assignments(
+            client, hit_id,
+            fields=['WorkerId'],
+            AssignmentStatuses=['Approved']
+        )
+        worker_ids.update(a.WorkerId for a in assignments)
+    return worker_ids
+
+
+def grant_qualification(client, qualification, worker_ids, value=1, n_threads=8):
+    def _grant(worker_id):
+        try:
+            client.associate_qualification_with_worker(
+                QualificationTypeId=qualification,
+                WorkerId=worker_id,
+                IntegerValue=value,
+                SendNotification=False
+            )
+        except Exception as e:
+            print('\tCould not assign qualification to worker `{}`: {}'
+                  .format(worker_id, e))
+            return None
+        return worker_id
+
+    with ThreadPoolExecutor(n_threads) as pool:
+        granted = [w for w in pool.map(_grant, worker_ids) if w is not None]
+    return granted
+
+
+def granted_file(fp, qualification):
+    root, ext = os.path.splitext(fp)
+    return '{}.{}{}'.format(root, qualification, ext)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description=DESCRIPTION,
+        formatter_class=CustomFormatter)
+
+    parser.add_argument(
+        "-i",
+        "--index",
+        default=INDEX_FILE,
+        type=str,
+        help="path to the participant index")
+
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+    subparsers.required = True
+
+    update = subparsers.add_parser(
+        "update",
+        formatter_class=CustomFormatter,
+        help="add newly paid workers to the index")
+    update.add_argument(
+        "-t",
+        "--title",
+        metavar="TITLE",
+        type=str,
+        help="also add the approved workers from HITs with this title")
+    update.add_argument(
+        "--grant",
+        metavar="QUALIFICATION",
+        type=str,
+        help="assign this qualification to indexed workers who don't have it")
+    update.add_argument(
+        "--value",
+        default=1,
+        type=int,
+        help="qualification value")
+
+    check = subparsers.add_parser(
+        "check",
+        formatter_class=CustomFormatter,
+        help="check whether workers are in the index")
+    check.add_argument(
+        "workers",
+        metavar="WORKER",
+        nargs="+",
+        help="worker ID")
+
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    start_profiling(args)
+
+    index = load_index(args.index)
+
+    if args.command == 'check':
+        for worker, seen in zip(args.workers, contains(index, args.workers)):
+            print('{}\t{}'.format(worker, 'PRIOR' if seen else 'NEW'))
+        sys.exit()
+
+    client = None
+    worker_ids = ledger_workers()
+    if args.title:
+        client = mturk_client()
+        worker_ids |= hit_workers(client, args.title)
+
+    new_ids = difference(to_ids(worker_ids), index) if worker_ids else []
+    if len(new_ids):
+        index = merge(index, new_ids)
+        save_index(index, args.index)
+
+    print('Added {} new workers to `{}` ({} total)'
+          .format(len(new_ids), args.index, len(index)))
+
+    if args.grant:
+        fp = granted_file(args.index, args.grant)
+        granted = load_index(fp)
+        to_grant = difference(np.asarray(index), granted)
+
+        print('Assigning qualification `{}` to {} workers...'
+              .format(args.grant, len(to_grant)))
+
+        if len(to_grant):
+            client = client or mturk_client()
+            new_granted = grant_qualification(
+                client, args.grant,
+                [w.decode('utf-8') for w in to_grant.tolist()], args.value)
+
+            if new_granted:
+                save_index(merge(granted, to_ids(new_granted)), fp)
+            print('Assigned qualification to {} workers'.format(len(new_granted)))
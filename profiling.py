@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Common `--profile` / `--trace_memory` options for the scripts.
+
+    >>> add_profiling_arguments(parser)
+    >>> args = parser.parse_args()
+    >>> start_profiling(args)
+
+`--profile FILE` runs the rest of the script under cProfile and writes the
+stats to FILE on exit (inspect them with `python -m pstats FILE`), printing the
+top functions by cumulative time. Threads started while profiling (e.g. the
+scripts' `ThreadPoolExecutor` workers) are profiled too and merged into the
+same stats; work done in child processes is profiled with `profile_call`.
+`--trace_memory` traces allocations with tracemalloc and prints the top
+allocation sites, the peak traced memory and the peak RSS of the process on
+exit.
+"""
+import sys
+import atexit
+import pstats
+import cProfile
+import resource
+import threading
+import tracemalloc
+
+N_TOP = 20
+
+# from Python 3.12 cProfile is built on sys.monitoring, which already sees
+# every thread; before that, each thread needs a profiler of its own
+PER_THREAD = sys.version_info < (3, 12)
+
+
+class ThreadedProfile(object):
+    """cProfile profile of the calling thread and of every thread started
+    while it is enabled"""
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _profile_thread(self, frame, event, arg):
+        # called on the first event in a new thread; enabling the thread's
+        # profiler replaces this hook
+        profile = cProfile.Profile()
+        with self._lock:
+            self._threads.append(profile)
+        profile.enable()
+
+    def enable(self):
+        if PER_THREAD:
+            threading.setprofile(self._profile_thread)
+        self._profile.enable()
+
+    def disable(self):
+        self._profile.disable()
+        if PER_THREAD:
+            threading.setprofile(None)
+
+    def stats(self, stream=None):
+        stats = pstats.Stats(self._profile, stream=stream)
+        with self._lock:
+            for profile in self._threads:
+                stats.add(profile)
+        return stats
+
+
+def add_profiling_arguments(parser):
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        type=str,
+        help="write cProfile stats for this run to FILE")
+
+    parser.add_argument(
+        "--trace_memory",
+        "--trace-memory",
+        action="store_true",
+        help="report the top memory allocations and peak RSS on exit")
+
+
+def start_profiling(args):
+    trace_memory = getattr(args, 'trace_memory', False)
+    fp = getattr(args, 'profile', None)
+    if not trace_memory and not fp:
+        return
+
+    if trace_memory:
+        tracemalloc.start()
+
+    profile = ThreadedProfile() if fp else None
+    atexit.register(_report, profile, fp, trace_memory)
+    if profile is not None:
+        profile.enable()
+
+
+def _report(profile, fp, trace_memory):
+    # stop profiling first so the reports themselves don't show up in them
+    if profile is not None:
+        profile.disable()
+    if trace_memory:
+        report_memory()
+    if profile is not None:
+        report_profile(profile, fp)
+
+
+def report_profile(profile, fp, n_top=N_TOP):
+    stats = profile.stats(stream=sys.stderr)
+    stats.dump_stats(fp)
+
+    print('\nProfile written to `{}`. Top {} functions by cumulative time:'
+          .format(fp, n_top), file=sys.stderr)
+    stats.sort_stats('cumulative').print_stats(n_top)
+
+
+def profile_call(fp, func, *args, **kwargs):
+    """Call `func` under a `ThreadedProfile` and write its stats to `fp`, e.g.
+    to profile the work done in a `multiprocessing.Pool` worker"""
+    profile = ThreadedProfile()
+    profile.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profile.disable()
+        profile.stats().dump_stats(fp)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return peak / 1024. ** 2
+    return peak / 1024.
+
+
+def report_memory(n_top=N_TOP):
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print('\nTop {} allocation sites:'.format(n_top), file=sys.stderr)
+    for ix, stat in enumerate(snapshot.statistics('lineno')[:n_top]):
+        print('\t{}. {}'.format(ix + 1, stat), file=sys.stderr)
+
+    print('Traced memory: {:.1f} MB current, {:.1f} MB peak'
+          .format(current / 1024. ** 2, peak / 1024. ** 2), file=sys.stderr)
+    print('Peak RSS: {:.1f} MB'.format(peak_rss_mb()), file=sys.stderr)
@@ -7,8 +7,14 @@ import time
 import logging
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter
 
+import boto3
+import numpy as np
 import pexpect
 
+from rate_limiter import SharedRateLimiter, RateLimitedClient, CLIENT_CONFIG
+from batch_simulator import compare_schedules, fit_arrival_model, posting_rounds
+from profiling import add_profiling_arguments, start_profiling
+
 DESCRIPTION = """
 Emulate TurkPrime's HyperBatch feature to avoid accruing an extra 20% MTurk fee
 for having more than 9 subjects / HIT. Based on Dave Eargle's
@@ -21,6 +27,14 @@ Usage
 -----
 Place in the same directory as the experiment's `config.txt` and run
     >>> psiturk_batcher.py <N. assignments to post> <Reward per assignment> <Assignment duration>
+
+To compare candidate schedules before posting anything, simulate them with
+`--simulate`. The worker arrival model (arrivals per minute at the study's HIT
+group right after a round is posted, and how fast that rate decays) is either
+given with `--arrival_rate` / `--decay` or fitted from the AcceptTimes of a
+past study with `--fit_title`:
+    >>> psiturk_batcher.py 90 1.50 1 --simulate --fit_title <HIT title> \\
+    ...     --sim_max_assignments 5 9 --sim_sleep_times 5 10 30
 """
 
 
@@ -62,6 +76,43 @@ def _doNothing():
 logger.write = _write
 logger.flush = _doNothing
 
+# psiturk makes its own MTurk calls, so clear each HIT with the shared rate
+# limiter before handing it over
+rate_limiter = SharedRateLimiter()
+
+
+def mturk_client():
+    print("Connecting to mechanical turk...")
+    key_id = os.environ['AWS_ACCESS_KEY_ID']
+    key = os.environ['AWS_SECRET_ACCESS_KEY']
+
+    client = boto3.client(
+        'mturk',
+        aws_access_key_id=key_id,
+        aws_secret_access_key=key,
+        config=CLIENT_CONFIG
+    )
+    return RateLimitedClient(client, account=key_id)
+
+
+def print_simulation(results, n_sims, horizon):
+    def _minutes(seconds):
+        return '-' if np.isnan(seconds) else '{:.1f}'.format(seconds / 60.)
+
+    print('\nSimulated {} runs per schedule over {:.1f} hours\n'
+          .format(n_sims, horizon / 3600.))
+    print('{:>8} {:>7} {:>5} {:>8} {:>9} {:>9} {:>17} {:>9} {:>9}'.format(
+        'max/HIT', 'sleep', 'HITs', 'P(done)', 'p50 min', 'p90 min',
+        'unfilled p50/90/99', 'E[cost]', 'max cost'))
+    for r in sorted(results, key=lambda r: (-r['p_complete'], r['expected_cost'],
+                                            r['completion_p50'])):
+        print('{:>8} {:>7} {:>5} {:>8.1%} {:>9} {:>9} {:>17} {:>9.2f} {:>9.2f}'.format(
+            r['max_assignments'], r['sleep_time'], r['n_hits'], r['p_complete'],
+            _minutes(r['completion_p50']), _minutes(r['completion_p90']),
+            '{:.0f}/{:.0f}/{:.0f}'.format(
+                r['unfilled_p50'], r['unfilled_p90'], r['unfilled_p99']),
+            r['expected_cost'], r['max_cost']))
+
 
 def create_hit(n_assignments, reward, duration):
     logger.info('Creating a HIT with %s assignments' % n_assignments)
@@ -72,6 +123,8 @@ def create_hit(n_assignments, reward, duration):
     command = ['psiturk', '-e', cmd]
     logger.info('> ' + ' '.join(command))
 
+    rate_limiter.acquire('create_hit')
+
     pexpect.run(" ".join(command), logfile=logger)
     return True
 
@@ -110,7 +163,61 @@ if __name__ == "__main__":
         type=int,
         help="time (in seconds) to sleep before posting a new batch")
 
+    parser.add_argument(
+        "--simulate",
+        action="store_true",
+        help="simulate the candidate schedules instead of posting HITs")
+
+    parser.add_argument(
+        "--arrival_rate",
+        type=float,
+        help="simulated workers per minute arriving at the study's HIT group "
+        "right after a round is posted")
+
+    parser.add_argument(
+        "--decay",
+        type=float,
+        help="time constant (in minutes) of the decay in arrivals as a round ages")
+
+    parser.add_argument(
+        "--fit_title",
+        metavar="TITLE",
+        type=str,
+        help="fit the arrival model to past HITs with this title")
+
+    parser.add_argument(
+        "--sim_max_assignments",
+        nargs="+",
+        type=int,
+        help="candidate values of --max_assignments to simulate. "
+        "default: --max_assignments")
+
+    parser.add_argument(
+        "--sim_sleep_times",
+        nargs="+",
+        type=int,
+        help="candidate values of --sleep_time to simulate. default: --sleep_time")
+
+    parser.add_argument(
+        "--horizon",
+        default=24.,
+        type=float,
+        help="simulated time (in hours) for the study to fill up")
+
+    parser.add_argument(
+        "--n_sims",
+        default=5000,
+        type=int,
+        help="number of simulated runs per schedule")
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="random seed for the simulations")
+
+    add_profiling_arguments(parser)
     args = parser.parse_args()
+    start_profiling(args)
 
     TOTAL_ASSIGNMENTS = args.n_assignments
     SPACING = args.sleep_time
@@ -128,12 +235,37 @@ if __name__ == "__main__":
         raise ValueError(
             'Invalid number of assignments: {}'.format(TOTAL_ASSIGNMENTS))
 
+    if args.simulate:
+        if args.fit_title:
+            arrival_rate, decay = fit_arrival_model(mturk_client(), args.fit_title)
+            logger.info("Fitted arrival model: %.2f workers/minute, decaying over "
+                        "%.1f minutes" % (arrival_rate * 60, decay / 60))
+        elif args.arrival_rate and args.decay:
+            arrival_rate, decay = args.arrival_rate / 60., args.decay * 60.
+        else:
+            parser.error('--simulate needs --fit_title or both --arrival_rate '
+                         'and --decay')
+
+        candidates = [(m, s)
+                      for m in args.sim_max_assignments or [MAX_ASSIGNMENTS_PER_HIT]
+                      for s in args.sim_sleep_times or [SPACING]]
+        results = compare_schedules(
+            TOTAL_ASSIGNMENTS, HIT_REWARD, candidates, arrival_rate, decay,
+            args.horizon * 3600, args.n_sims, args.seed)
+        for m, s in sorted(set(candidates) - set(
+                (r['max_assignments'], r['sleep_time']) for r in results)):
+            logger.info("Skipping --max_assignments %s --sleep_time %s: "
+                        "no rounds fit in 60 seconds" % (m, s))
+        print_simulation(results, args.n_sims, args.horizon * 3600)
+        sys.exit()
+
     # derived variables
     total_time = 60
-    n_rounds = int(total_time / SPACING)
+    rounds = posting_rounds(
+        TOTAL_ASSIGNMENTS, SPACING, MAX_ASSIGNMENTS_PER_HIT, total_time)
+    n_rounds = len(rounds)
     assignments_per_round = int(TOTAL_ASSIGNMENTS / n_rounds)
-    total_assignments_wo_mod = n_rounds * assignments_per_round
-    assignments_remainder = TOTAL_ASSIGNMENTS % total_assignments_wo_mod
+    assignments_remainder = TOTAL_ASSIGNMENTS - n_rounds * assignments_per_round
 
     logger.info(
         "Total time: %s seconds" % total_time)
@@ -156,27 +288,14 @@ if __name__ == "__main__":
         logger.info('Exiting...')
         sys.exit()
 
-    for rr in range(1, n_rounds + 1):
+    for rr, hit_sizes in enumerate(rounds, 1):
         logger.info("\n")
         logger.info("ROUND {}".format(rr))
-        n_assignments_this_round = assignments_per_round
-
-        if rr <= assignments_remainder:
-            n_assignments_this_round += 1
-
-        n_hits_this_round = int(
-            n_assignments_this_round / MAX_ASSIGNMENTS_PER_HIT)
-        n_assignments_for_mod_hit = n_assignments_this_round % MAX_ASSIGNMENTS_PER_HIT
-
         logger.info(
-            "TOTAL assignments for this round: %s" % n_assignments_this_round)
-
-        for hit in range(n_hits_this_round):
-            proc = create_hit(MAX_ASSIGNMENTS_PER_HIT, HIT_REWARD,
-                              HIT_DURATION)
+            "TOTAL assignments for this round: %s" % sum(hit_sizes))
 
-        if n_assignments_for_mod_hit > 0:
-            create_hit(n_assignments_for_mod_hit, HIT_REWARD, HIT_DURATION)
+        for n_assignments_this_hit in hit_sizes:
+            create_hit(n_assignments_this_hit, HIT_REWARD, HIT_DURATION)
 
         logger.info("Sleeping for %s seconds..." % SPACING)
         time.sleep(SPACING)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Token-bucket rate limiter shared by every script running against the same
+requester account.
+
+The bucket state lives in a small JSON file in the system temp directory (one
+file per access key id) and is updated under an exclusive `flock`, so
+`approve_batch.py`, several `bonus_worker.py` processes and the batcher can
+run at the same time and together stay just below the account's request rate.
+Every call takes a token from the account-wide `*` bucket and, if the
+operation has its own budget, from that operation's bucket too.
+
+Budgets are `(calls per second, burst size)` pairs; a rate of 0 leaves the
+bucket unlimited. The defaults in `DEFAULT_BUDGETS` can be overridden with a
+JSON file (`rate_limits.json` in the current directory), e.g.
+
+    {"*": [8, 16], "send_bonus": [2, 4]}
+
+The budgets are stored in the state file along with the buckets, so every
+process refills at the same rates: a process configured explicitly (with a
+budgets file, or like `multi_account.py` with the account's
+`max_calls_per_second`) writes its budgets there, and the others use
+whatever budgets the file holds, falling back to `DEFAULT_BUDGETS`.
+"""
+import os
+import json
+import time
+import fcntl
+import hashlib
+import tempfile
+
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError
+
+BUDGETS_FILE = 'rate_limits.json'
+DEFAULT_BUDGETS = {
+    '*': (5., 10.),
+    'send_bonus': (2., 4.),
+    'approve_assignment': (3., 6.),
+    'associate_qualification_with_worker': (3., 6.),
+    'create_hit': (1., 3.),
+}
+
+THROTTLING_ERRORS = ['Throttling', 'ThrottlingException',
+                     'RequestLimitExceeded', 'TooManyRequestsException']
+TRANSIENT_ERRORS = ['ServiceFault', 'ServiceUnavailable', 'InternalError',
+                    'InternalFailure']
+MAX_RETRIES = 3
+
+# `RateLimitedClient` owns the retry loop, so botocore must not retry on its
+# own first: build the wrapped clients with `config=CLIENT_CONFIG`
+CLIENT_CONFIG = Config(retries={'total_max_attempts': 1})
+
+
+def load_budgets(fp=BUDGETS_FILE):
+    """Return the default budgets updated from `fp`, or None if there is no
+    budgets file"""
+    if not os.path.lexists(fp):
+        return None
+    budgets = dict(DEFAULT_BUDGETS)
+    with open(fp, 'r') as handle:
+        budgets.update((k, tuple(v)) for k, v in json.load(handle).items())
+    return budgets
+
+
+class SharedRateLimiter(object):
+    def __init__(self, account=None, budgets=None, state_dir=None):
+        account = account or os.environ.get('AWS_ACCESS_KEY_ID', 'default')
+        digest = hashlib.sha1(account.encode('utf-8')).hexdigest()[:12]
+
+        # explicit budgets are written to the shared state; otherwise the
+        # budgets already stored there (if any) are used
+        self.budgets = budgets or load_budgets()
+        self.fp = os.path.join(
+            state_dir or tempfile.gettempdir(), 'mturk_rate_{}.json'.format(digest))
+
+    def _shared_budgets(self, state):
+        if self.budgets is not None:
+            state['_budgets'] = self.budgets
+        budgets = state.setdefault('_budgets', DEFAULT_BUDGETS)
+        return dict((k, tuple(v)) for k, v in budgets.items())
+
+    def _buckets(self, budgets, operation):
+        buckets = ['*', operation] if operation in budgets else ['*']
+        return [b for b in buckets if b in budgets and budgets[b][0] > 0]
+
+    def _update(self, func):
+        """Apply `func` to the bucket state under an exclusive lock"""
+        with open(self.fp, 'a+') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                handle.seek(0)
+                content = handle.read()
+                state = json.loads(content) if content else {}
+
+                result = func(state, self._shared_budgets(state), time.time())
+
+                handle.seek(0)
+                handle.truncate()
+                json.dump(state, handle)
+                handle.flush()
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+        return result
+
+    def _refill(self, state, budgets, now, bucket):
+        rate, burst = budgets[bucket]
+        tokens, last = state.get(bucket, (burst, now))
+        tokens = min(burst, tokens + (now - last) * rate)
+        state[bucket] = (tokens, now)
+        return tokens
+
+    def acquire(self, operation='*'):
+        """Block until a call to `operation` fits within the budgets"""
+        def _take(state, budgets, now):
+            buckets = self._buckets(budgets, operation)
+            tokens = [self._refill(state, budgets, now, b) for b in buckets]
+            if all(t >= 1 for t in tokens):
+                for b, t in zip(buckets, tokens):
+                    state[b] = (t - 1, now)
+                return 0.
+
+            # time until every bucket holds a full token again
+            return max((1 - t) / budgets[b][0]
+                       for b, t in zip(buckets, tokens) if t < 1)
+
+        while True:
+            wait = self._update(_take)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def drain(self, operation='*'):
+        """Empty the buckets for `operation` after the account was throttled,
+        so that every process backs off together"""
+        def _drain(state, budgets, now):
+            for b in self._buckets(budgets, operation):
+                state[b] = (0., now)
+
+        self._update(_drain)
+
+
+class RateLimitedClient(object):
+    """Wrap a boto3 MTurk client so every call is cleared with a
+    `SharedRateLimiter` first. Throttled calls drain the shared buckets before
+    being retried; other transient failures are retried with a backoff. The
+    client should be built with `config=CLIENT_CONFIG`"""
+
+    def __init__(self, client, limiter=None, account=None):
+        self._client = client
+        self._limiter = limiter or SharedRateLimiter(account)
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name.startswith('_') or \
+                name in ['can_paginate', 'get_paginator', 'get_waiter']:
+            return attr
+
+        def limited(*args, **kwargs):
+            for retry in range(MAX_RETRIES + 1):
+                self._limiter.acquire(name)
+                try:
+                    return attr(*args, **kwargs)
+                except BotoConnectionError:
+                    if retry == MAX_RETRIES:
+                        raise
+                    time.sleep(0.5 * 2 ** retry)
+                except ClientError as e:
+                    code = e.response.get('Error', {}).get('Code')
+                    if retry == MAX_RETRIES:
+                        raise
+                    if code in THROTTLING_ERRORS:
+                        self._limiter.drain(name)
+                    elif code in TRANSIENT_ERRORS:
+                        time.sleep(0.5 * 2 ** retry)
+                    else:
+                        raise
+        return limited
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import csv
+from concurrent.futures import ThreadPoolExecutor
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter
+
+import boto3
+import numpy as np
+
+from ledger import Ledger
+from records import iter_hits, iter_assignments, iter_records, to_array
+from rate_limiter import RateLimitedClient, CLIENT_CONFIG
+from profiling import add_profiling_arguments, start_profiling
+
+DESCRIPTION = """
+Reconcile the local payment ledger against MTurk.
+
+Streams every assignment and bonus payment on the account (optionally only
+for HITs with a given title) and compares them with the ledger, reporting:
+
+  - submitted work that hasn't been approved yet
+  - assignments approved on MTurk but missing from the ledger
+  - assignments recorded as approved in the ledger but not approved on MTurk
+  - bonus payments missing from the ledger
+  - bonuses recorded in the ledger with no matching payment on MTurk
+  - assignments that were bonused more than once
+
+Usage
+-----
+    >>> export AWS_ACCESS_KEY_ID=<MTurk access key id>
+    >>> export AWS_SECRET_ACCESS_KEY=<MTurk secret access key>
+    >>> reconcile.py -t <HIT title> -o discrepancies.csv
+"""
+
+ASSIGNMENT_FIELDS = ['AssignmentId', 'WorkerId', 'HITId', 'AssignmentStatus']
+BONUS_FIELDS = ['AssignmentId', 'WorkerId', 'BonusAmount']
+
+REPORTS = [
+    ('unpaid', 'Submitted assignments awaiting approval'),
+    ('approved_not_in_ledger', 'Approved on MTurk but missing from the ledger'),
+    ('ledger_not_approved', 'Approved in the ledger but not on MTurk'),
+    ('bonus_not_in_ledger', 'Bonus payments missing from the ledger'),
+    ('ledger_bonus_not_paid', 'Bonuses in the ledger with no payment on MTurk'),
+    ('duplicate_bonus', 'Assignments bonused more than once'),
+]
+
+
+class CustomFormatter(ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter):
+    pass
+
+
+def mturk_client():
+    print("Connecting to mechanical turk...")
+    key_id = os.environ['AWS_ACCESS_KEY_ID']
+    key = os.environ['AWS_SECRET_ACCESS_KEY']
+
+    client = boto3.client(
+        'mturk',
+        aws_access_key_id=key_id,
+        aws_secret_access_key=key,
+        config=CLIENT_CONFIG
+    )
+    return RateLimitedClient(client, account=key_id)
+
+
+def fetch_mturk(client, title=None, n_threads=8):
+    """Return structured arrays of every assignment and bonus payment on the
+    HITs with `title` (or on all HITs), plus the IDs of the HITs scanned"""
+    hits = iter_hits(client.list_hits, fields=['HITId', 'Title'], MaxResults=100)
+    hit_ids = [h.HITId for h in hits if not title or h.Title == title]
+
+    def _fetch(hit_id):
+        assignments = list(iter_assignments(client, hit_id, fields=ASSIGNMENT_FIELDS))
+        bonuses = list(iter_records(
+            client.list_bonus_payments, 'BonusPayments', BONUS_FIELDS,
+            HITId=hit_id, MaxResults=100))
+        return assignments, bonuses
+
+    assignments, bonuses = [], []
+    with ThreadPoolExecutor(n_threads) as pool:
+        for a, b in pool.map(_fetch, hit_ids):
+            assignments += a
+            bonuses += b
+
+    return (to_array(assignments, ASSIGNMENT_FIELDS),
+            to_array(bonuses, BONUS_FIELDS),
+            hit_ids)
+
+
+def _ids(values):
+    return np.array([v.encode('utf-8') for v in values], dtype=np.bytes_) \
+        if len(values) else np.array([], dtype='S1')
+
+
+def reconcile(assignments, bonuses, ledger, hit_ids):
+    """Diff the MTurk `assignments` / `bonuses` arrays against `ledger`.
+    Returns a dict mapping each report in `REPORTS` to an array of assignment IDs"""
+    scanned = set(hit_ids)
+    approve_records = ledger.records('approve')
+    bonus_records = ledger.records('bonus')
+
+    ledger_approved = _ids([r['key'] for r in approve_records])
+    ledger_bonused = _ids([r['key'] for r in bonus_records])
+
+    # only hold ledger records against MTurk if they belong to a scanned HIT
+    ledger_approved_scanned = _ids(
+        [r['key'] for r in approve_records if r.get('hit_id') in scanned])
+    ledger_bonused_scanned = _ids(
+        [r['key'] for r in bonus_records if r.get('hit_id') in scanned])
+
+    ass_ids = assignments['AssignmentId']
+    status = assignments['AssignmentStatus']
+    submitted = ass_ids[status == b'Submitted']
+    approved = ass_ids[status == b'Approved']
+
+    bonus_ids, counts = np.unique(bonuses['AssignmentId'], return_counts=True)
+
+    return {
+        'unpaid': np.setdiff1d(submitted, ledger_approved),
+        'approved_not_in_ledger': np.setdiff1d(approved, ledger_approved),
+        'ledger_not_approved': np.setdiff1d(ledger_approved_scanned, approved),
+        'bonus_not_in_ledger': np.setdiff1d(bonus_ids, ledger_bonused),
+        'ledger_bonus_not_paid': np.setdiff1d(ledger_bonused_scanned, bonus_ids),
+        'duplicate_bonus': bonus_ids[counts > 1],
+    }
+
+
+def print_report(report, assignments, limit=10):
+    workers = dict(zip(assignments['AssignmentId'].tolist(),
+                       assignments['WorkerId'].tolist()))
+
+    for name, label in REPORTS:
+        ids = report[name]
+        print('\n{}: {}'.format(label, len(ids)))
+        for ass_id in ids[:limit].tolist():
+            print('\t{}\t{}'.format(ass_id.decode('utf-8'),
+                                    workers.get(ass_id, b'').decode('utf-8')))
+        if len(ids) > limit:
+            print('\t... and {} more'.format(len(ids) - limit))
+
+
+def write_report(report, assignments, fp):
+    workers = dict(zip(assignments['AssignmentId'].tolist(),
+                       assignments['WorkerId'].tolist()))
+
+    with open(fp, 'w', newline='') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(['discrepancy', 'assignment_id', 'worker_id'])
+        for name, _ in REPORTS:
+            for ass_id in report[name].tolist():
+                writer.writerow([name, ass_id.decode('utf-8'),
+                                 workers.get(ass_id, b'').decode('utf-8')])
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description=DESCRIPTION,
+        formatter_class=CustomFormatter)
+
+    parser.add_argument(
+        '-t',
+        "--title",
+        metavar="TITLE",
+        type=str,
+        help="only reconcile HITs with this title. default: all HITs")
+
+    parser.add_argument(
+        '-l',
+        "--ledger",
+        default="ledger.tsv",
+        type=str,
+        help="path to the payment ledger")
+
+    parser.add_argument(
+        '-o',
+        "--output",
+        type=str,
+        help="also write every discrepancy to this CSV file")
+
+    parser.add_argument(
+        "--limit",
+        default=10,
+        type=int,
+        help="maximum number of assignments to print per report")
+
+    parser.add_argument(
+        '-n',
+        "--n_threads",
+        default=8,
+        type=int,
+        help="number of HITs to fetch concurrently")
+
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    start_profiling(args)
+
+    ledger = Ledger(args.ledger)
+    client = mturk_client()
+
+    print('Retrieving assignments and bonus payments...')
+    assignments, bonuses, hit_ids = fetch_mturk(client, args.title, args.n_threads)
+    print('Found {} assignments and {} bonus payments on {} HITs'
+          .format(len(assignments), len(bonuses), len(hit_ids)))
+
+    report = reconcile(assignments, bonuses, ledger, hit_ids)
+    print_report(report, assignments, args.limit)
+
+    if args.output:
+        write_report(report, assignments, args.output)
+        print('\nWrote discrepancies to `{}`'.format(args.output))
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Compact records for HITs and assignments.
+
+The boto3 responses carry much more than the scripts use (ResponseMetadata,
+the Question XML, QualificationRequirements, ...). `iter_records` streams the
+pages of a list operation and projects each item onto a `__slots__` record
+holding only the requested fields, so the full response dicts can be freed as
+soon as each page has been read. Records support both attribute access and
+dict-style indexing (`hit.HITId` / `hit['HITId']`), so they can stand in for
+the response dicts in existing code. For bulk paths, `to_array` packs records
+into a numpy structured array.
+"""
+import datetime
+
+import numpy as np
+
+HIT_FIELDS = ('HITId', 'HITTypeId', 'HITGroupId', 'Title', 'HITStatus')
+ASSIGNMENT_FIELDS = ('AssignmentId', 'WorkerId', 'HITId', 'AssignmentStatus',
+                     'SubmitTime')
+
+_RECORD_TYPES = {}
+
+
+class Record(object):
+    __slots__ = ()
+
+    def __init__(self, item):
+        for field in self.__slots__:
+            setattr(self, field, item.get(field))
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field)
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(f, getattr(self, f)) for f in self.__slots__))
+
+
+def record_type(fields):
+    """Return the (cached) `Record` subclass with slots for `fields`"""
+    fields = tuple(fields)
+    if fields not in _RECORD_TYPES:
+        _RECORD_TYPES[fields] = type('Record', (Record,), {'__slots__': fields})
+    return _RECORD_TYPES[fields]
+
+
+def iter_records(func, key, fields, **kwargs):
+    """Stream the items under `key` in each page of the paginated boto3
+    request `func(**kwargs)`, projected onto records with only `fields`"""
+    cls = record_type(fields)
+    response = func(**kwargs)
+    while True:
+        for item in response[key]:
+            yield cls(item)
+
+        if response['NumResults'] == 0 or 'NextToken' not in response:
+            return
+        response = func(NextToken=response['NextToken'], **kwargs)
+
+
+def iter_hits(func, fields=HIT_FIELDS, **kwargs):
+    return iter_records(func, 'HITs', fields, **kwargs)
+
+
+def iter_assignments(client, hit_id, fields=ASSIGNMENT_FIELDS, **kwargs):
+    return iter_records(
+        client.list_assignments_for_hit, 'Assignments', fields,
+        HITId=hit_id, MaxResults=100, **kwargs)
+
+
+def _to_utc(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return np.datetime64(value, 's')
+
+
+def _column(values):
+    """Convert a list of field values to a numpy array of a compact dtype"""
+    sample = next((v for v in values if v is not None), '')
+    if isinstance(sample, datetime.datetime):
+        return np.array([_to_utc(v) if v else np.datetime64('NaT')
+                         for v in values], dtype='datetime64[s]')
+    if isinstance(sample, (bool, int, float)):
+        return np.array(values)
+    return np.array([v.encode('utf-8') if v else b'' for v in values],
+                    dtype=np.bytes_)
+
+
+def to_array(records, fields):
+    """Pack `records` into a numpy structured array with one column per field.
+    Strings are stored as fixed-width bytes and datetimes as UTC datetime64"""
+    records = list(records)
+    columns = [_column([r[f] for r in records]) for f in fields]
+
+    arr = np.zeros(len(records), dtype=[(f, c.dtype) for f, c in zip(fields, columns)])
+    for f, col in zip(fields, columns):
+        arr[f] = col
+    return arr
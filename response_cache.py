@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk read-through cache for MTurk responses that can no longer change.
+
+`CachedClient` wraps a boto3 MTurk client. Calls to the read operations in
+`CACHED_OPERATIONS` are keyed by operation name and arguments and stored in a
+small SQLite database. Responses in a terminal state (a Disposed or fully
+reviewed HIT, an Approved / Rejected assignment, a qualification type) are
+kept until evicted; all others expire after `ttl` seconds. Calls to the write
+operations in `WRITE_OPERATIONS` invalidate any cached response that refers to
+the same HIT, assignment or qualification type. The cache holds at most
+`max_entries` responses and evicts the least recently used ones first.
+"""
+import json
+import time
+import pickle
+import sqlite3
+import threading
+
+CACHE_FILE = '.mturk_cache.sqlite'
+DEFAULT_TTL = 60
+MAX_ENTRIES = 50000
+
+ID_FIELDS = ['HITId', 'AssignmentId', 'QualificationTypeId']
+
+
+def _hit_is_final(response):
+    hit = response['HIT']
+    if hit['HITStatus'] == 'Disposed':
+        return True
+    return (hit['HITStatus'] == 'Reviewable'
+            and hit['NumberOfAssignmentsPending'] == 0
+            and hit['NumberOfAssignmentsCompleted'] == hit['MaxAssignments'])
+
+
+def _assignment_is_final(response):
+    return response['Assignment']['AssignmentStatus'] in ['Approved', 'Rejected']
+
+
+def _always_final(response):
+    return True
+
+
+# read operations to cache, mapped to a function that decides whether the
+# response is in a terminal state
+CACHED_OPERATIONS = {
+    'get_hit': _hit_is_final,
+    'get_assignment': _assignment_is_final,
+    'get_qualification_type': _always_final,
+}
+
+WRITE_OPERATIONS = [
+    'approve_assignment',
+    'reject_assignment',
+    'create_additional_assignments_for_hit',
+    'delete_hit',
+    'update_expiration_for_hit',
+    'update_hit_review_status',
+    'update_hit_type_of_hit',
+    'update_qualification_type',
+    'delete_qualification_type',
+]
+
+
+def _ids(*dicts):
+    """Collect the HIT, assignment and qualification type IDs in `dicts`"""
+    ids = set()
+    for d in dicts:
+        for field in ID_FIELDS:
+            if d.get(field):
+                ids.add(d[field])
+    return ids
+
+
+class ResponseCache(object):
+    def __init__(self, fp=CACHE_FILE, ttl=DEFAULT_TTL, max_entries=MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(fp, timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS responses '
+                '(key TEXT PRIMARY KEY, value BLOB, expires REAL, accessed REAL)')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS tags (tag TEXT, key TEXT)')
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag)')
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS responses_accessed '
+                'ON responses (accessed)')
+
+    @staticmethod
+    def key(operation, kwargs):
+        return operation + json.dumps(kwargs, sort_keys=True)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                'SELECT value, expires FROM responses WHERE key = ?',
+                (key,)).fetchone()
+            if row is None:
+                return None
+
+            value, expires = row
+            if expires is not None and expires < now:
+                self._delete([key])
+                return None
+
+            self._db.execute(
+                'UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+        return pickle.loads(value)
+
+    def put(self, key, response, tags, final):
+        now = time.time()
+        expires = None if final else now + self.ttl
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                (key, pickle.dumps(response), expires, now))
+            self._db.execute('DELETE FROM tags WHERE key = ?', (key,))
+            self._db.executemany(
+                'INSERT INTO tags VALUES (?, ?)', [(t, key) for t in tags])
+            self._evict()
+
+    def invalidate(self, tags):
+        with self._lock, self._db:
+            keys = set()
+            for tag in tags:
+                rows = self._db.execute(
+                    'SELECT key FROM tags WHERE tag = ?', (tag,))
+                keys.update(r[0] for r in rows)
+            self._delete(keys)
+
+    def _delete(self, keys):
+        for key in keys:
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self._db.execute('DELETE FROM tags WHERE key = ?', (key,))
+
+    def _evict(self):
+        n_entries = self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        if n_entries <= self.max_entries:
+            return
+
+        rows = self._db.execute(
+            'SELECT key FROM responses ORDER BY accessed LIMIT ?',
+            (n_entries - self.max_entries,))
+        self._delete([r[0] for r in rows.fetchall()])
+
+
+class CachedClient(object):
+    """Wrap a boto3 MTurk client with a `ResponseCache`"""
+
+    def __init__(self, client, cache=None):
+        self._client = client
+        self._cache = cache or ResponseCache()
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+
+        if name in CACHED_OPERATIONS:
+            is_final = CACHED_OPERATIONS[name]
+
+            def cached(**kwargs):
+                key = self._cache.key(name, kwargs)
+                response = self._cache.get(key)
+                if response is None:
+                    response = attr(**kwargs)
+                    response.pop('ResponseMetadata', None)
+                    records = [v for v in response.values() if isinstance(v, dict)]
+                    tags = _ids(kwargs, *records)
+                    self._cache.put(key, response, tags, is_final(response))
+                return response
+            return cached
+
+        if name in WRITE_OPERATIONS:
+            def invalidating(**kwargs):
+                try:
+                    return attr(**kwargs)
+                finally:
+                    self._cache.invalidate(_ids(kwargs))
+            return invalidating
+
+        return attr
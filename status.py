@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter
+
+import boto3
+
+from records import iter_hits, iter_assignments
+from rate_limiter import RateLimitedClient, CLIENT_CONFIG
+from profiling import add_profiling_arguments, start_profiling
+
+DESCRIPTION = """
+Summarize the assignments on the account per experiment (HIT title / HIT type):
+how many are in progress, available, submitted, approved and rejected.
+
+The per-HIT counts are saved to a snapshot file. On later runs only the HITs
+whose state can still change are refreshed; HITs that are Disposed, or
+Reviewable with every assignment approved or rejected, are read from the
+snapshot instead, unless their listed status or assignment counts differ from
+the snapshot (e.g. after the HIT was extended).
+
+Usage
+-----
+    >>> export AWS_ACCESS_KEY_ID=<MTurk access key id>
+    >>> export AWS_SECRET_ACCESS_KEY=<MTurk secret access key>
+    >>> status.py -t <HIT title>
+"""
+
+SNAPSHOT_FILE = 'status_snapshot.json'
+ASSIGNMENT_STATUSES = ['Submitted', 'Approved', 'Rejected']
+COLUMNS = ['HITs', 'Pending', 'Available'] + ASSIGNMENT_STATUSES
+HIT_FIELDS = ['HITId', 'Title', 'HITTypeId', 'HITStatus', 'MaxAssignments',
+              'NumberOfAssignmentsPending', 'NumberOfAssignmentsAvailable',
+              'NumberOfAssignmentsCompleted']
+
+
+class CustomFormatter(ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter):
+    pass
+
+
+def mturk_client():
+    print("Connecting to mechanical turk...")
+    key_id = os.environ['AWS_ACCESS_KEY_ID']
+    key = os.environ['AWS_SECRET_ACCESS_KEY']
+
+    client = boto3.client(
+        'mturk',
+        aws_access_key_id=key_id,
+        aws_secret_access_key=key,
+        config=CLIENT_CONFIG
+    )
+    return RateLimitedClient(client, account=key_id)
+
+
+def load_snapshot(fp=SNAPSHOT_FILE):
+    if not os.path.lexists(fp):
+        return {}
+    with open(fp, 'r') as handle:
+        return json.load(handle)
+
+
+def save_snapshot(snapshot, fp=SNAPSHOT_FILE):
+    tmp = fp + '.tmp'
+    with open(tmp, 'w') as handle:
+        json.dump(snapshot, handle)
+    os.replace(tmp, fp)
+
+
+def is_final(entry):
+    """True if the counts for a HIT can no longer change"""
+    if entry['status'] == 'Disposed':
+        return True
+    return (entry['status'] == 'Reviewable'
+            and entry['Pending'] == 0
+            and entry['Submitted'] == 0)
+
+
+def has_changed(entry, hit):
+    """True if the listed `hit` no longer matches its snapshot `entry`"""
+    return (entry['status'] != hit['HITStatus']
+            or entry['Pending'] != hit['NumberOfAssignmentsPending']
+            or entry['Available'] != hit['NumberOfAssignmentsAvailable']
+            or entry.get('MaxAssignments') != hit['MaxAssignments']
+            or entry.get('Completed') != hit['NumberOfAssignmentsCompleted'])
+
+
+def hit_entry(client, hit):
+    entry = {
+        'title': hit['Title'],
+        'hit_type': hit['HITTypeId'],
+        'status': hit['HITStatus'],
+        'Pending': hit['NumberOfAssignmentsPending'],
+        'Available': hit['NumberOfAssignmentsAvailable'],
+        'MaxAssignments': hit['MaxAssignments'],
+        'Completed': hit['NumberOfAssignmentsCompleted'],
+    }
+    entry.update((s, 0) for s in ASSIGNMENT_STATUSES)
+
+    # if nothing has been approved or rejected yet, the number of submitted
+    # assignments follows from the HIT counts without listing them
+    if hit['NumberOfAssignmentsCompleted'] == 0:
+        entry['Submitted'] = max(
+            0, hit['MaxAssignments'] - entry['Pending'] - entry['Available'])
+        return entry
+
+    for ass in iter_assignments(client, hit.HITId, fields=['AssignmentStatus']):
+        entry[ass.AssignmentStatus] += 1
+    return entry
+
+
+def refresh(client, snapshot, n_threads=8):
+    """Update `snapshot` in place from a single pass over the account's HITs.
+    Returns the number of HITs whose assignments were re-counted"""
+    seen = set()
+
+    def _refresh(hit):
+        snapshot[hit['HITId']] = hit_entry(client, hit)
+
+    with ThreadPoolExecutor(n_threads) as pool:
+        stale = []
+        for hit in iter_hits(client.list_hits, fields=HIT_FIELDS, MaxResults=100):
+            seen.add(hit.HITId)
+            entry = snapshot.get(hit.HITId)
+            if entry is None or not is_final(entry) or has_changed(entry, hit):
+                stale.append(hit)
+        list(pool.map(_refresh, stale))
+
+    # HITs that are no longer listed have been deleted
+    for hit_id, entry in snapshot.items():
+        if hit_id not in seen:
+            entry['status'] = 'Disposed'
+            entry['Pending'] = entry['Available'] = 0
+    return len(stale)
+
+
+def summarize(snapshot, title=None):
+    summary = {}
+    for entry in snapshot.values():
+        if title and entry['title'] != title:
+            continue
+
+        key = (entry['title'], entry['hit_type'])
+        counts = summary.setdefault(key, dict((c, 0) for c in COLUMNS))
+        counts['HITs'] += 1
+        for c in COLUMNS[1:]:
+            counts[c] += entry[c]
+    return summary
+
+
+def print_summary(summary):
+    print('\n{:<40}{:<32}'.format('Title', 'HIT type') +
+          ''.join('{:>11}'.format(c) for c in COLUMNS))
+
+    for (title, hit_type), counts in sorted(summary.items()):
+        print('{:<40}{:<32}'.format(title[:39], hit_type) +
+              ''.join('{:>11}'.format(counts[c]) for c in COLUMNS))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description=DESCRIPTION,
+        formatter_class=CustomFormatter)
+
+    parser.add_argument(
+        '-t',
+        "--title",
+        metavar="TITLE",
+        type=str,
+        help="only show HITs with this title. default: all HITs")
+
+    parser.add_argument(
+        '-s',
+        "--snapshot",
+        default=SNAPSHOT_FILE,
+        type=str,
+        help="path of the snapshot file")
+
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="ignore the snapshot and re-count every HIT")
+
+    parser.add_argument(
+        '-n',
+        "--n_threads",
+        default=8,
+        type=int,
+        help="number of HITs to re-count concurrently")
+
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    start_profiling(args)
+
+    snapshot = {} if args.full else load_snapshot(args.snapshot)
+
+    client = mturk_client()
+
+    print('Retrieving HITs...')
+    n_refreshed = refresh(client, snapshot, args.n_threads)
+    save_snapshot(snapshot, args.snapshot)
+
+    print('Refreshed {} of {} HITs'.format(n_refreshed, len(snapshot)))
+    print_summary(summarize(snapshot, args.title))